@@ -0,0 +1,272 @@
+import math
+import numpy as np
+import astropy.constants as const
+
+try:
+    from numba import njit
+    has_numba = True
+except ImportError:
+    has_numba = False
+
+    # Without numba the kernels run as plain NumPy functions
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+
+        def decorator(func):
+            return func
+        return decorator
+
+# Physical constants in CGS units as plain floats
+h_cgs = const.h.cgs.value
+k_B_cgs = const.k_B.cgs.value
+c_cgs = const.c.cgs.value
+Msun_g = const.M_sun.cgs.value
+Jy_cgs = 1e-23
+
+# Fast-math flags that still allow inf values, since the Wien
+# tail of a cold blackbody overflows np.expm1 to inf. The kernels
+# release the GIL so walkers can be evaluated in parallel threads
+fastmath = {'nsz', 'arcp', 'contract', 'afn', 'reassoc'}
+
+
+@njit(fastmath=fastmath, cache=True, nogil=True, error_model='numpy')
+def planck_kernel(nu_hz, temperature):
+    """
+    Calculate the Planck function B_nu(T) using np.expm1, which
+    avoids the cancellation of exp(x) - 1 in the Rayleigh-Jeans tail.
+
+    Parameters
+    ----------
+    nu_hz : array
+        Frequency in Hz
+    temperature : float or array
+        Temperature in Kelvin
+
+    Returns
+    -------
+    bb_radiance : array
+        Spectral radiance in erg/s/cm^2/sr/Hz
+    """
+
+    return (2 * h_cgs / c_cgs**2) * nu_hz**3 / np.expm1(h_cgs * nu_hz / (k_B_cgs * temperature))
+
+
+@njit(fastmath=fastmath, cache=True, nogil=True, error_model='numpy')
+def escape_probability_kernel(kappa_cgs, dust_mass_g, radius_cm):
+    """
+    Calculate the escape probability of photons from an optically
+    thick spherical dust shell.
+
+    Parameters
+    ----------
+    kappa_cgs : array
+        Dust opacity in cm^2/g
+    dust_mass_g : float or array
+        Dust mass in grams
+    radius_cm : float
+        Radius of the dust shell in cm
+
+    Returns
+    -------
+    Pesc : array
+        Escape probability
+    """
+
+    # Calculate optical depth
+    tau = (3.0/4.0) * kappa_cgs * dust_mass_g / (np.pi * radius_cm**2)
+    return (3.0/(4.0*tau))*(1-1/(2.0*tau**2)+(1/tau + 1/(2*tau**2))*np.exp(-2*tau))
+
+
+@njit(fastmath=fastmath, cache=True, nogil=True, error_model='numpy')
+def dust_luminosity_kernel(nu_hz, kappa_cgs, dust_mass_g, temperature, radius_cm=0.0, thick=False):
+    """
+    Calculate the luminosity of a single dust component in erg/s/Hz.
+
+    Parameters
+    ----------
+    nu_hz : array
+        Rest-frame frequency in Hz
+    kappa_cgs : array
+        Dust opacity in cm^2/g at each frequency
+    dust_mass_g : float
+        Dust mass in grams
+    temperature : float
+        Dust temperature in Kelvin
+    radius_cm : float, default 0.0
+        Radius of the dust shell in cm, only used if thick is True
+    thick : bool, default False
+        If True, apply the escape probability of an optically thick shell
+
+    Returns
+    -------
+    luminosity : array
+        Luminosity in erg/s/Hz
+    """
+
+    # Total luminosity integrated over 4 pi sr
+    luminosity = 4 * np.pi * dust_mass_g * kappa_cgs * planck_kernel(nu_hz, temperature)
+
+    if thick:
+        luminosity = escape_probability_kernel(kappa_cgs, dust_mass_g, radius_cm) * luminosity
+
+    return luminosity
+
+
+@njit(fastmath=fastmath, cache=True, nogil=True, error_model='numpy')
+def model_flux_kernel(obs_wave_um, kappas, log_dust_masses, temperatures, redshift, distance_cm,
+                      radius_cm=0.0, thick=False):
+    """
+    Calculate the observed flux density of one or more dust
+    components for a batch of parameter sets, fusing the
+    luminosity and flux calculations.
+
+    Parameters
+    ----------
+    obs_wave_um : array
+        Observer-frame wavelength in microns
+    kappas : 2D array
+        Dust opacity in cm^2/g of each component, with shape
+        (n_components, len(obs_wave_um))
+    log_dust_masses : 2D array
+        Log of the dust mass of each component in solar masses,
+        with shape (n_samples, n_components)
+    temperatures : 2D array
+        Temperature of each component in Kelvin, with shape
+        (n_samples, n_components)
+    redshift : float
+        Redshift of the object
+    distance_cm : float
+        Luminosity distance in cm
+    radius_cm : float, default 0.0
+        Radius of the dust shell in cm, only used if thick is True
+    thick : bool, default False
+        If True, use optically thick dust
+
+    Returns
+    -------
+    flux : 2D array
+        Flux density in Jy, with shape (n_samples, len(obs_wave_um))
+    """
+
+    # Rest-frame frequency in Hz
+    nu_hz = c_cgs * (1 + redshift) / (obs_wave_um * 1e-4)
+
+    # Parts of the Planck function shared by all components
+    bb_scale = (2 * h_cgs / c_cgs**2) * nu_hz**3
+    h_nu_k = h_cgs * nu_hz / k_B_cgs
+
+    # Single factor that converts M[Msun] * kappa * B_nu to Jy, the 4 pi sr
+    # of the luminosity cancels with the 4 pi d^2 of the flux
+    flux_scale = Msun_g * (1 + redshift) / (distance_cm**2 * Jy_cgs)
+
+    # Add the emission of all components, broadcasting over samples
+    flux = np.zeros((log_dust_masses.shape[0], obs_wave_um.shape[0]))
+    for i in range(log_dust_masses.shape[1]):
+        dust_mass = 10**log_dust_masses[:, i:i+1]
+        emission = dust_mass * kappas[i] * bb_scale / np.expm1(h_nu_k / temperatures[:, i:i+1])
+        if thick:
+            emission = escape_probability_kernel(kappas[i], dust_mass * Msun_g, radius_cm) * emission
+        flux += emission
+
+    return flux_scale * flux
+
+
+@njit(fastmath=fastmath, cache=True, nogil=True, error_model='numpy')
+def log_ndtr_kernel(z):
+    """
+    Calculate the log of the standard normal CDF, staying finite far
+    in the lower tail where the CDF itself underflows.
+
+    Parameters
+    ----------
+    z : float
+        Number of standard deviations
+
+    Returns
+    -------
+    log_cdf : float
+        Log of the normal CDF at z
+    """
+
+    if z > 0:
+        # Use the upper tail to keep the precision of values close to zero
+        return math.log1p(-0.5 * math.erfc(z / math.sqrt(2.0)))
+    elif z > -20:
+        return math.log(0.5 * math.erfc(-z / math.sqrt(2.0)))
+    else:
+        # Asymptotic expansion of the lower tail
+        z2 = z * z
+        series = -1 / z2 + 3 / z2**2 - 15 / z2**3 + 105 / z2**4 - 945 / z2**5
+        return -0.5 * z2 - math.log(-z) - 0.5 * math.log(2 * np.pi) + math.log1p(series)
+
+
+@njit(fastmath=fastmath, cache=True, nogil=True, error_model='numpy')
+def ln_like_kernel(flux_model, det_idx, det_flux, det_inv_err_sq, limit_idx, limit_flux, limit_err, sigma):
+    """
+    Calculate the log likelihood of a batch of model fluxes, without the
+    constant normalization of the detections.
+
+    Parameters
+    ----------
+    flux_model : 2D array
+        Model flux in Jy, with shape (n_samples, n_data)
+    det_idx : array
+        Indices of the detections
+    det_flux : array
+        Flux of the detections in Jy
+    det_inv_err_sq : array
+        Inverse of the squared uncertainties of the detections
+    limit_idx : array
+        Indices of the upper limits
+    limit_flux : array
+        Flux of the upper limits in Jy
+    limit_err : array
+        Uncertainties of the upper limits in Jy
+    sigma : array
+        Additional fractional variance of each sample
+
+    Returns
+    -------
+    ln_like : array
+        Log likelihood of each sample
+    """
+
+    ln_like = np.zeros(flux_model.shape[0])
+    for i in range(flux_model.shape[0]):
+        # Detections, with the uncertainties scaled by (1 + sigma)
+        chi2 = 0.0
+        for j in range(det_idx.shape[0]):
+            det_error = det_flux[j] - flux_model[i, det_idx[j]]
+            chi2 += det_inv_err_sq[j] * det_error * det_error
+        ln_like[i] = -0.5 * chi2 / (1 + sigma[i])**2 - det_idx.shape[0] * math.log(1 + sigma[i])
+
+        # Upper limits
+        for j in range(limit_idx.shape[0]):
+            ln_like[i] += log_ndtr_kernel((flux_model[i, limit_idx[j]] - limit_flux[j]) / limit_err[j])
+
+    return ln_like
+
+
+def compile_kernels():
+    """
+    Compile every kernel for the argument types used by dustysn. The callers
+    in dustysn.model always pass writeable C-contiguous float64 arrays, int64
+    indices, and explicit float and bool scalars, so these are the only
+    signatures needed. With numba, the machine code is written to the on-disk
+    cache, so that later Python processes load it instead of compiling the
+    kernels again.
+    """
+
+    wave = np.linspace(5.0, 20.0, 4)
+    nu_hz = c_cgs / (wave * 1e-4)
+    index = np.arange(4, dtype=np.int64)
+    model_flux_kernel(wave, np.ones((1, 4)), np.array([[-3.0]]), np.array([[500.0]]), 0.0, 1e25, 0.0, False)
+    dust_luminosity_kernel(nu_hz, np.ones(4), 1e30, 500.0, 1e16, True)
+    ln_like_kernel(np.ones((1, 4)), index[:2].copy(), np.ones(2), np.ones(2), index[2:].copy(), np.ones(2),
+                   np.ones(2), np.zeros(1))
+
+
+# Compile the kernels at import so the first MCMC step does not pay for it,
+# running "python -m dustysn.kernels" after installing fills the cache
+compile_kernels()
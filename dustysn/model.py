@@ -1,15 +1,17 @@
-from .utils import calc_distance, calc_filter_flux, import_coefficients, interpolate_kappa, import_data
+from .utils import calc_distance, calc_filter_weights, import_coefficients, interpolate_kappa, import_data
 from .plot import plot_corner, plot_trace
+from .kernels import c_cgs, Msun_g, has_numba, dust_luminosity_kernel, model_flux_kernel, ln_like_kernel
 import warnings
 import scipy.special as sp
 import emcee
 import matplotlib.pyplot as plt
-from astropy.modeling.models import BlackBody
+from matplotlib.collections import LineCollection
 import numpy as np
 import astropy.units as u
 from astropy import table
 import os
-from multiprocessing import Pool
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 plt.rcParams.update({'font.size': 12})
 plt.rcParams.update({'font.family': 'serif'})
 
@@ -22,6 +24,9 @@ except NameError:
     current_file_dir = os.getcwd()
 data_dir = os.path.join(current_file_dir, 'ref_data')
 
+# Random number generator used to redraw walkers between MCMC runs
+rng = np.random.default_rng()
+
 # Define priors for the 2-component model
 ref_priors = {
     'log_dust_mass_cold': (-6, 1),
@@ -35,6 +40,47 @@ ref_priors = {
 }
 
 
+def calc_luminosity_fast(nu_hz, kappa_cgs, dust_mass_g, temperature, radius_cm=None, dust_type='thin'):
+    """
+    Calculate the intrinsic luminosity of dust emission using plain
+    float arrays in fixed CGS units. This is the unitless version of
+    calc_luminosity used inside the MCMC.
+
+    Parameters
+    ----------
+    nu_hz : array
+        Rest-frame frequency in Hz
+    kappa_cgs : array
+        Dust opacity in cm^2/g interpolated to the rest-frame frequency
+    dust_mass_g : float
+        Dust mass in grams
+    temperature : float
+        Dust temperature in Kelvin
+    radius_cm : float, optional
+        For the optically thick case, the radius of the dust shell in cm.
+    dust_type : str, default 'thin'
+        Type of dust emission ('thin' for optically thin, 'thick' for optically thick).
+
+    Returns
+    -------
+    luminosity : array
+        Luminosity in erg/s/Hz
+    """
+
+    if dust_type == 'thin':
+        thick = False
+        radius_cm = 0.0
+    elif dust_type == 'thick':
+        if radius_cm is None:
+            raise ValueError("For optically thick dust, radius must be provided.")
+        thick = True
+    else:
+        raise ValueError("dust_type must be 'thin' or 'thick'.")
+
+    return dust_luminosity_kernel(np.asarray(nu_hz, dtype=float), np.asarray(kappa_cgs, dtype=float),
+                                  float(dust_mass_g), float(temperature), float(radius_cm), thick)
+
+
 def calc_luminosity(rest_wave, kappa_interp, dust_mass, temperature, radius=None,
                     output_units='nu', dust_type='thin'):
     """
@@ -73,44 +119,26 @@ def calc_luminosity(rest_wave, kappa_interp, dust_mass, temperature, radius=None
     if not isinstance(rest_wave, u.Quantity):
         rest_wave = rest_wave * u.micron
 
-    # Make sure temperature is a Quantity in Kelvin
-    if not isinstance(temperature, u.Quantity):
-        temperature = temperature * u.K
-
-    # Making sure dust mass is a Quantity in solar masses
-    if not isinstance(dust_mass, u.Quantity):
-        dust_mass = dust_mass * u.Msun
-
-    # Make sure radius is a Quantity in cm if provided
-    if dust_type == 'thick':
-        if radius is None:
-            raise ValueError("For optically thick dust, radius must be provided.")
-        if not isinstance(radius, u.Quantity):
-            radius = radius * u.cm
-
-    # Create blackbody model
-    bb = BlackBody(temperature=temperature)
-
-    # Calculate blackbody spectral radiance at observed wavelengths
-    # in units of erg/s/cm^2/sr/Hz
-    bb_radiance = bb(rest_wave)
-
-    if dust_type == 'thin':
-        # Calculate total luminosity in erg/s/Hz
-        luminosity_in = dust_mass * kappa_interp * bb_radiance * (4 * np.pi * u.sr)
-    elif dust_type == 'thick':
-        # Calculate optical depth
-        tau = ((3.0/4.0) * kappa_interp * dust_mass / (np.pi * radius**2)).cgs
-        # Calculate the escape probability for a spherical shell
-        Pesc = (3.0/(4.0*tau))*(1-1/(2.0*tau**2)+(1/tau + 1/(2*tau**2))*np.exp(-2*tau))
-        # Calculate luminosity for optically thick dust
-        luminosity_in = Pesc * dust_mass * kappa_interp * bb_radiance * (4 * np.pi * u.sr)
+    # Strip units to plain CGS values
+    nu_hz = c_cgs / rest_wave.to(u.cm).value
+    if isinstance(kappa_interp, u.Quantity):
+        kappa_interp = kappa_interp.to(u.cm**2 / u.g).value
+    if isinstance(temperature, u.Quantity):
+        temperature = temperature.to(u.K).value
+    if isinstance(dust_mass, u.Quantity):
+        dust_mass_g = dust_mass.to(u.g).value
     else:
-        raise ValueError("dust_type must be 'thin' or 'thick'.")
+        dust_mass_g = dust_mass * Msun_g
+    if isinstance(radius, u.Quantity):
+        radius = radius.to(u.cm).value
+
+    # Calculate luminosity in erg/s/Hz
+    luminosity_in = calc_luminosity_fast(nu_hz, np.asarray(kappa_interp), dust_mass_g, temperature,
+                                         radius_cm=radius, dust_type=dust_type) * (u.erg / u.s / u.Hz)
 
     # Convert output to desired units
     if output_units == 'nu':
-        luminosity = luminosity_in.to(u.erg / u.s / u.Hz)
+        luminosity = luminosity_in
     elif output_units == 'lambda':
         luminosity = luminosity_in.to(u.erg / u.s / u.AA, equivalencies=u.spectral_density(rest_wave))
     else:
@@ -165,9 +193,15 @@ def calc_flux(rest_wave, luminosity, distance, redshift, output_units='Jy'):
     # Calculate observer-frame wavelength
     obs_wave = rest_wave * (1 + redshift)
 
-    # Convert flux to requested units
-    if output_units == 'Jy':
+    # Convert flux to requested units, converting between Hz and Jy
+    # directly since it does not need the spectral density equivalency
+    per_hz = flux_in.unit.is_equivalent(u.erg / u.s / u.cm / u.cm / u.Hz)
+    if output_units == 'Jy' and per_hz:
+        flux = flux_in.to_value(u.erg / u.s / u.cm / u.cm / u.Hz) * 1e23 * u.Jy
+    elif output_units == 'Jy':
         flux = flux_in.to(u.Jy, equivalencies=u.spectral_density(obs_wave))
+    elif output_units == 'nu' and per_hz:
+        flux = flux_in.to(u.erg / u.s / u.cm / u.cm / u.Hz)
     elif output_units == 'nu':
         flux = flux_in.to(u.erg / u.s / u.cm / u.cm / u.Hz, equivalencies=u.spectral_density(obs_wave))
     elif output_units == 'lambda':
@@ -245,9 +279,130 @@ def calc_model_flux(obs_wave, dust_mass, temperature, redshift, radius=None, dis
     return flux
 
 
+def model_flux_batch(thetas, obs_wave, kappa_interp, redshift, distance, radius=None, n_components=1,
+                     obs_wave_filters=None, obs_trans_filters=None, kappa_interp_hot=None,
+                     kappa_interp_cold=None, kappa_interp_warm=None, dust_type='thin', filter_weights=None,
+                     unitless=False):
+    """
+    Calculate the model flux for a batch of parameter sets at once,
+    with support for one, two, or three dust components.
+
+    Parameters
+    ----------
+    thetas : 2D array
+        Parameter sets with shape (n_samples, 2 * n_components), where each row is
+        (log_dust_mass_cold, temp_cold, log_dust_mass_hot, temp_hot, log_dust_mass_warm, temp_warm)
+        truncated to the number of components
+    obs_wave : array or Quantity
+        Observer-frame wavelength in microns
+    kappa_interp : array or Quantity
+        Dust opacity data in cm^2/g pre-interpolated to the
+        rest-frame wavelengths of obs_wave
+    redshift : float
+        Redshift of the object
+    distance : float or Quantity
+        Luminosity distance in cm
+    radius : float, optional
+        Radius of the dust shell in cm. Only used if dust_type is 'thick'.
+    n_components : int, default 1
+        Number of dust components (1, 2, or 3)
+    obs_wave_filters : list of arrays, optional
+        Wavelengths of the filters used in the observations
+    obs_trans_filters : list of arrays, optional
+        Transmission of the filters used in the observations
+    kappa_interp_hot : array or Quantity, optional
+        Pre-interpolated dust opacity data for the hot component in cm^2/g.
+    kappa_interp_cold : array or Quantity, optional
+        Pre-interpolated dust opacity data for the cold component in cm^2/g.
+    kappa_interp_warm : array or Quantity, optional
+        Pre-interpolated dust opacity data for the warm component in cm^2/g.
+    dust_type : str, default 'thin'
+        Type of dust emission ('thin' for optically thin, 'thick' for optically thick).
+    filter_weights : scipy.sparse.csr_matrix or numpy.ndarray, optional
+        Precomputed filter integration weights from calc_filter_weights. If None
+        and filters are provided, they will be calculated.
+    unitless : bool, default False
+        If True, return a plain array in Jansky instead of a Quantity
+
+    Returns
+    -------
+    flux : 2D array
+        Model flux in Jansky with shape (n_samples, n_wavelengths), or
+        (n_samples, n_filters) if filters are provided
+    """
+
+    thetas = np.atleast_2d(np.asarray(thetas, dtype=float))
+
+    # If components have different compositions
+    if kappa_interp_cold is None:
+        kappa_interp_cold = kappa_interp
+    if kappa_interp_hot is None:
+        kappa_interp_hot = kappa_interp
+    if kappa_interp_warm is None:
+        kappa_interp_warm = kappa_interp
+
+    if n_components == 1:
+        kappas = [kappa_interp]
+    elif n_components == 2:
+        kappas = [kappa_interp_cold, kappa_interp_hot]
+    elif n_components == 3:
+        kappas = [kappa_interp_cold, kappa_interp_hot, kappa_interp_warm]
+    else:
+        raise ValueError("n_components must be 1, 2, or 3")
+
+    if thetas.shape[1] != 2 * n_components:
+        raise ValueError(f"theta must have {2 * n_components} parameters for {n_components} components.")
+
+    # Validate the dust type
+    if dust_type == 'thin':
+        thick = False
+        radius = 0.0
+    elif dust_type == 'thick':
+        if radius is None:
+            raise ValueError("For optically thick dust, radius must be provided.")
+        thick = True
+    else:
+        raise ValueError("dust_type must be 'thin' or 'thick'.")
+
+    # Strip units once and pack the components for the compiled kernel
+    if isinstance(obs_wave, u.Quantity):
+        obs_wave_um = obs_wave.to(u.micron).value
+    else:
+        obs_wave_um = np.asarray(obs_wave, dtype=float)
+    if isinstance(distance, u.Quantity):
+        distance = distance.to(u.cm).value
+    if isinstance(radius, u.Quantity):
+        radius = radius.to(u.cm).value
+    if any(kappa is None for kappa in kappas):
+        raise ValueError("Pre-interpolated kappa_interp arrays must be provided for every component.")
+    kappas = np.array([kappa.to(u.cm**2 / u.g).value if isinstance(kappa, u.Quantity) else kappa
+                       for kappa in kappas], dtype=float)
+    if kappas.shape != (n_components, len(obs_wave_um)):
+        raise ValueError("kappa_interp must be interpolated to the same wavelengths as obs_wave.")
+
+    # Calculate flux density in Jy, masses and temperatures alternate in theta. The kernel
+    # always receives C-contiguous arrays, so it is only compiled for one set of array layouts
+    flux = model_flux_kernel(np.ascontiguousarray(obs_wave_um, dtype=float), kappas,
+                             np.ascontiguousarray(thetas[:, 0::2]), np.ascontiguousarray(thetas[:, 1::2]),
+                             float(redshift), float(distance), float(radius), bool(thick))
+
+    # Integrate the model flux through the filters
+    if (filter_weights is None) and (obs_wave_filters is not None):
+        filter_weights = calc_filter_weights(obs_wave_um, obs_wave_filters, obs_trans_filters)
+    if filter_weights is not None:
+        flux_model = np.ascontiguousarray(filter_weights.dot(flux.T).T)
+    else:
+        flux_model = flux
+
+    if unitless:
+        return flux_model
+    return flux_model * u.Jy
+
+
 def model_flux(theta, obs_wave, obs_flux, kappa_interp, redshift, distance, radius=None,
                n_components=1, obs_wave_filters=None, obs_trans_filters=None, kappa_interp_hot=None,
-               kappa_interp_cold=None, kappa_interp_warm=None, dust_type='thin'):
+               kappa_interp_cold=None, kappa_interp_warm=None, dust_type='thin', filter_weights=None,
+               unitless=False):
     """
     Calculate model flux for given parameters with support for one or two dust components.
 
@@ -261,7 +416,8 @@ def model_flux(theta, obs_wave, obs_flux, kappa_interp, redshift, distance, radi
     obs_flux : array or Quantity
         Observed flux in Jy
     kappa_interp : array or Quantity
-        Pre-interpolated dust opacity data in cm^2/g
+        Dust opacity data in cm^2/g pre-interpolated to the
+        rest-frame wavelengths of obs_wave
     redshift : float
         Redshift of the object
     distance : float or Quantity
@@ -278,6 +434,11 @@ def model_flux(theta, obs_wave, obs_flux, kappa_interp, redshift, distance, radi
         Pre-interpolated dust opacity data for the warm component in cm^2/g.
     obs_wave_filters : list of arrays, optional
         Wavelengths of the filters used in the observations
+    filter_weights : scipy.sparse.csr_matrix or numpy.ndarray, optional
+        Precomputed filter integration weights from calc_filter_weights. If None
+        and filters are provided, they will be calculated.
+    unitless : bool, default False
+        If True, return a plain array in Jansky instead of a Quantity
 
     Returns
     -------
@@ -285,79 +446,132 @@ def model_flux(theta, obs_wave, obs_flux, kappa_interp, redshift, distance, radi
         Model flux in Jansky
     """
 
-    if n_components == 1:
-        log_dust_mass_cold, temp_cold = theta
-        dust_mass_cold = 10**log_dust_mass_cold
+    flux_model = model_flux_batch([theta], obs_wave, kappa_interp, redshift, distance, radius, n_components,
+                                  obs_wave_filters=obs_wave_filters, obs_trans_filters=obs_trans_filters,
+                                  kappa_interp_hot=kappa_interp_hot, kappa_interp_cold=kappa_interp_cold,
+                                  kappa_interp_warm=kappa_interp_warm, dust_type=dust_type,
+                                  filter_weights=filter_weights, unitless=unitless)
 
-        # Calculate flux for single component
-        flux = calc_model_flux(obs_wave, dust_mass_cold, temp_cold, redshift, distance=distance,
-                               kappa_interp=kappa_interp, dust_type=dust_type, radius=radius)
+    return flux_model[0]
 
-    elif n_components == 2:
-        log_dust_mass_cold, temp_cold, log_dust_mass_hot, temp_hot = theta
-        dust_mass_cold = 10**log_dust_mass_cold
-        dust_mass_hot = 10**log_dust_mass_hot
-
-        # If components have different compositions
-        if kappa_interp_cold is None:
-            kappa_interp_cold = kappa_interp
-        if kappa_interp_hot is None:
-            kappa_interp_hot = kappa_interp
-
-        # Calculate flux for each component and add them
-        flux1 = calc_model_flux(obs_wave, dust_mass_cold, temp_cold, redshift, distance=distance,
-                                kappa_interp=kappa_interp_cold, dust_type=dust_type, radius=radius)
-        flux2 = calc_model_flux(obs_wave, dust_mass_hot, temp_hot, redshift, distance=distance,
-                                kappa_interp=kappa_interp_hot, dust_type=dust_type, radius=radius)
-        flux = flux1 + flux2
 
-    elif n_components == 3:
-        log_dust_mass_cold, temp_cold, log_dust_mass_hot, temp_hot, log_dust_mass_warm, temp_warm = theta
-        dust_mass_cold = 10**log_dust_mass_cold
-        dust_mass_hot = 10**log_dust_mass_hot
-        dust_mass_warm = 10**log_dust_mass_warm
-
-        # If components have different compositions
-        if kappa_interp_cold is None:
-            kappa_interp_cold = kappa_interp
-        if kappa_interp_hot is None:
-            kappa_interp_hot = kappa_interp
-        if kappa_interp_warm is None:
-            kappa_interp_warm = kappa_interp
-
-        # Calculate flux for each component and add them
-        flux1 = calc_model_flux(obs_wave, dust_mass_cold, temp_cold, redshift, distance=distance,
-                                kappa_interp=kappa_interp_cold, dust_type=dust_type, radius=radius)
-        flux2 = calc_model_flux(obs_wave, dust_mass_hot, temp_hot, redshift, distance=distance,
-                                kappa_interp=kappa_interp_hot, dust_type=dust_type, radius=radius)
-        flux3 = calc_model_flux(obs_wave, dust_mass_warm, temp_warm, redshift, distance=distance,
-                                kappa_interp=kappa_interp_warm, dust_type=dust_type, radius=radius)
-        flux = flux1 + flux2 + flux3
+def prepare_fit_data(obs_flux, obs_flux_err, obs_limits):
+    """
+    Strip the units from the observed data and precompute every quantity
+    of the likelihood that does not depend on the model, so that it is
+    only done once per fit.
 
-    else:
-        raise ValueError("n_components must be 1, 2, or 3")
+    Parameters
+    ----------
+    obs_flux : array or Quantity
+        Observed flux in Jy
+    obs_flux_err : array or Quantity
+        Flux uncertainties in Jy
+    obs_limits : array
+        Boolean array indicating upper limits
 
-    if obs_wave_filters is not None:
-        # Apply filter transmission to the model flux
-        flux_model = np.zeros(len(obs_flux))
-        for i in range(len(obs_wave_filters)):
-            # Get the filter transmission for the current filter
-            obs_wave_filter = obs_wave_filters[i]
-            obs_trans_filter = obs_trans_filters[i]
-            output_flux = calc_filter_flux(obs_wave.value, flux.value, obs_wave_filter, obs_trans_filter)
-            flux_model[i] = output_flux
-        flux_model = flux_model * u.Jy
+    Returns
+    -------
+    fit_data : dict
+        Dictionary with contiguous float arrays of the detections
+        ('det_idx', 'det_flux', 'det_inv_err_sq', and the normalization
+        'log_norm') and upper limits ('limit_idx', 'limit_flux', 'limit_err')
+    """
+
+    if isinstance(obs_flux, u.Quantity):
+        obs_flux = obs_flux.to(u.Jy).value
+    if isinstance(obs_flux_err, u.Quantity):
+        obs_flux_err = obs_flux_err.to(u.Jy).value
+    obs_flux = np.asarray(obs_flux, dtype=float)
+    obs_flux_err = np.asarray(obs_flux_err, dtype=float)
+    obs_limits = np.asarray(obs_limits, dtype=bool)
+
+    det_idx = np.flatnonzero(~obs_limits)
+    limit_idx = np.flatnonzero(obs_limits)
+
+    fit_data = {
+        'det_idx': det_idx,
+        'det_flux': np.ascontiguousarray(obs_flux[det_idx]),
+        'det_inv_err_sq': np.ascontiguousarray(1.0 / obs_flux_err[det_idx] ** 2),
+        'log_norm': 0.5 * np.sum(np.log(2.0 * np.pi * obs_flux_err[det_idx] ** 2)),
+        'limit_idx': limit_idx,
+        'limit_flux': np.ascontiguousarray(obs_flux[limit_idx]),
+        'limit_err': np.ascontiguousarray(np.abs(obs_flux_err[limit_idx]))
+    }
+
+    return fit_data
+
+
+def calc_ln_like(flux_model, fit_data, sigma=0.0, normalize=True):
+    """
+    Calculate the log likelihood of one or more model fluxes, accounting
+    for upper limits in the data.
+
+    Parameters
+    ----------
+    flux_model : array
+        Model flux in Jy, either with shape (n_data,) or (n_samples, n_data)
+    fit_data : dict
+        Observed data, as returned by prepare_fit_data
+    sigma : float or array, default 0.0
+        Additional fractional variance added to the uncertainties, either
+        a float or an array with one value per sample
+    normalize : bool, default True
+        If True, include the constant normalization of the detections. The
+        MCMC is invariant to this additive constant, so it can be skipped
+
+    Returns
+    -------
+    ln_like : float or array
+        Log likelihood, one value per sample if flux_model is 2D
+    """
+
+    det_idx = fit_data['det_idx']
+    limit_idx = fit_data['limit_idx']
+
+    if has_numba:
+        # Compiled loop over the samples and data points
+        # Pass writeable C-contiguous arrays, matching the signature compiled by compile_kernels
+        flux_2d = np.ascontiguousarray(np.atleast_2d(flux_model), dtype=float)
+        sigma_2d = np.broadcast_to(sigma, flux_2d.shape[:1]).astype(float)
+        ln_like = ln_like_kernel(flux_2d, det_idx, fit_data['det_flux'], fit_data['det_inv_err_sq'],
+                                 limit_idx, fit_data['limit_flux'], fit_data['limit_err'], sigma_2d)
+        if np.ndim(flux_model) == 1:
+            ln_like = ln_like[0]
     else:
-        flux_model = flux
+        ln_like = 0.0
 
-    return flux_model
+        # Handle detections as usual, the uncertainties are scaled by (1 + sigma)
+        if len(det_idx) > 0:
+            det_error = fit_data['det_flux'] - flux_model[..., det_idx]
+            chi2 = np.sum(fit_data['det_inv_err_sq'] * det_error ** 2, axis=-1)
+            ln_like -= 0.5 * chi2 / (1 + sigma) ** 2
+
+            # Include the part of the normalization term that depends on sigma
+            ln_like -= len(det_idx) * np.log(1 + sigma)
+
+        # Handle upper limits
+        if len(limit_idx) > 0:
+            # Calculate how many sigma the model is from each limit
+            z = (flux_model[..., limit_idx] - fit_data['limit_flux']) / fit_data['limit_err']
+
+            # Add the log of the integral term of Equation 8 in https://arxiv.org/pdf/1210.0285,
+            # log_ndtr is the log of the normal CDF and stays finite where the CDF underflows
+            ln_like += np.sum(sp.log_ndtr(z), axis=-1)
+
+    # The constant part of the normalization term was precomputed by prepare_fit_data
+    if normalize:
+        ln_like -= fit_data['log_norm']
+
+    return ln_like
 
 
 def log_likelihood(theta, obs_wave, obs_flux, obs_flux_err, obs_limits,
                    kappa_interp, redshift, distance, radius=None, n_components=1,
                    obs_wave_filters=None, obs_trans_filters=None,
                    kappa_interp_hot=None, kappa_interp_cold=None,
-                   kappa_interp_warm=None, dust_type='thin', add_sigma=True):
+                   kappa_interp_warm=None, dust_type='thin', add_sigma=True, filter_weights=None,
+                   fit_data=None, normalize=True):
     """
     Function to calculate the log likelihood of a model, but accounting
     for upper limits in the data.
@@ -399,6 +613,14 @@ def log_likelihood(theta, obs_wave, obs_flux, obs_flux_err, obs_limits,
     add_sigma : bool, default True
         If True, add an additional variance to the uncertainties defined by the sigma
         parameter.
+    filter_weights : scipy.sparse.csr_matrix or numpy.ndarray, optional
+        Precomputed filter integration weights from calc_filter_weights. If None
+        and filters are provided, they will be calculated.
+    fit_data : dict, optional
+        Observed data as returned by prepare_fit_data. If None, it will be
+        calculated from obs_flux, obs_flux_err, and obs_limits.
+    normalize : bool, default True
+        If True, include the constant normalization term of the detections.
 
     Returns
     -------
@@ -406,7 +628,7 @@ def log_likelihood(theta, obs_wave, obs_flux, obs_flux_err, obs_limits,
         Log likelihood
     """
 
-    # Calculate model flux
+    # Calculate model flux as a plain array in Jy
     if add_sigma:
         theta_use, sigma = theta[:-1], 10 ** theta[-1]
     else:
@@ -414,34 +636,13 @@ def log_likelihood(theta, obs_wave, obs_flux, obs_flux_err, obs_limits,
     flux_model = model_flux(theta_use, obs_wave, obs_flux, kappa_interp, redshift, distance, radius,
                             n_components, obs_wave_filters=obs_wave_filters, obs_trans_filters=obs_trans_filters,
                             kappa_interp_hot=kappa_interp_hot, kappa_interp_cold=kappa_interp_cold,
-                            kappa_interp_warm=kappa_interp_warm, dust_type=dust_type)
-    ln_like = 0.0
-
-    # Handle detections as usual
-    is_detection = ~obs_limits
-    if np.any(is_detection):
-        det_error = obs_flux.value[is_detection] - flux_model.value[is_detection]
-        modified_error = obs_flux_err.value[is_detection] * (1 + sigma)
-        det_weight = 1.0 / modified_error ** 2
-        ln_like -= 0.5 * np.sum(det_weight * det_error ** 2)
-
-        # Include normalization term for the detections
-        ln_like -= 0.5 * np.sum(np.log(2.0 * np.pi * modified_error ** 2))
-
-    # Handle upper limits
-    if np.any(obs_limits):
-        # For each upper limit, calculate the integral term
-        for j in np.where(obs_limits)[0]:
-            # Calculate how many sigma the model is from the limit
-            z = (flux_model.value[j] - obs_flux.value[j]) / np.abs(obs_flux_err.value[j])
-
-            # Use the complementary error function to calculate the integral term
-            # of Equation 8 in https://arxiv.org/pdf/1210.0285
-            prob = 0.5 * (1 + sp.erf(z / np.sqrt(2)))
-            # Add the log of this probability to the likelihood
-            ln_like += np.log(prob) if prob > 0 else -np.inf
+                            kappa_interp_warm=kappa_interp_warm, dust_type=dust_type,
+                            filter_weights=filter_weights, unitless=True)
 
-    return ln_like
+    if fit_data is None:
+        fit_data = prepare_fit_data(obs_flux, obs_flux_err, obs_limits)
+
+    return calc_ln_like(flux_model, fit_data, sigma, normalize)
 
 
 def log_prior(theta, priors, n_components=1, flat_mass_prior=True,
@@ -561,12 +762,86 @@ def log_prior(theta, priors, n_components=1, flat_mass_prior=True,
         raise ValueError("n_components must be 1, 2, or 3")
 
 
+def _param_names(n_components, add_sigma=True):
+    """
+    Names of the model parameters in the order they appear in theta.
+
+    Parameters
+    ----------
+    n_components : int
+        Number of dust components (1, 2, or 3)
+    add_sigma : bool, default True
+        If True, include the sigma parameter at the end
+
+    Returns
+    -------
+    names : list
+        Names of the parameters
+    """
+
+    if n_components not in (1, 2, 3):
+        raise ValueError("n_components must be 1, 2, or 3")
+
+    components = ['cold', 'hot', 'warm'][:n_components]
+    names = [name for comp in components for name in [f'log_dust_mass_{comp}', f'temp_{comp}']]
+    if add_sigma:
+        names.append('sigma')
+
+    return names
+
+
+def log_prior_batch(thetas, priors, n_components=1, flat_mass_prior=True,
+                    mu_mass=-1.0, sigma_mass=1.0, add_sigma=True):
+    """
+    Calculate the log-prior for a batch of parameter sets with a single
+    array mask, equivalent to calling log_prior on each row.
+
+    Parameters
+    ----------
+    thetas : 2D array
+        Parameters of each walker, with shape (n_walkers, n_dim)
+    priors, n_components, flat_mass_prior, mu_mass, sigma_mass, add_sigma :
+        See log_prior
+
+    Returns
+    -------
+    log_prior : array
+        Log-prior of each walker
+    """
+
+    # Lower and upper bounds of every parameter
+    names = _param_names(n_components, add_sigma)
+    thetas = np.atleast_2d(thetas)
+    lo = np.array([priors[name][0] for name in names])
+    hi = np.array([priors[name][1] for name in names])
+    inside = np.all((thetas > lo) & (thetas < hi), axis=1)
+
+    # Temperature ordering of the components
+    log_masses, temps = thetas[:, 0:2 * n_components:2], thetas[:, 1:2 * n_components:2]
+    if n_components == 2:
+        inside &= temps[:, 1] > temps[:, 0]
+    elif n_components == 3:
+        inside &= (temps[:, 1] > temps[:, 0]) & (temps[:, 2] > temps[:, 0]) & (temps[:, 1] > temps[:, 2])
+
+    # Walkers outside of the prior are only evaluated to keep the calculation branchless
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        sigma = thetas[:, -1] if add_sigma else np.zeros(len(thetas))
+        log_prob = -np.log(10 ** sigma)
+        if not flat_mass_prior:
+            # Apply Gaussian prior on total dust mass
+            log_total_mass = np.log10(np.sum(10 ** log_masses, axis=1))
+            log_prob = log_prob - 0.5 * ((log_total_mass - mu_mass) / sigma_mass)**2
+
+    return np.where(inside, log_prob, -np.inf)
+
+
 def log_probability(theta, obs_wave, obs_flux, obs_flux_err, obs_limits,
                     kappa_interp, redshift, distance, radius=None, n_components=1,
                     obs_wave_filters=None, obs_trans_filters=None,
                     kappa_interp_hot=None, kappa_interp_cold=None,
                     kappa_interp_warm=None, dust_type='thin',
-                    flat_mass_prior=True, priors=None, add_sigma=True):
+                    flat_mass_prior=True, priors=None, add_sigma=True, filter_weights=None,
+                    fit_data=None):
     """
     Calculate the log-probability of the model given the observed data.
 
@@ -612,11 +887,17 @@ def log_probability(theta, obs_wave, obs_flux, obs_flux_err, obs_limits,
     add_sigma : bool, default True
         If True, add an additional variance to the uncertainties defined by the sigma
         parameter.
+    filter_weights : scipy.sparse.csr_matrix or numpy.ndarray, optional
+        Precomputed filter integration weights from calc_filter_weights. If None
+        and filters are provided, they will be calculated.
+    fit_data : dict, optional
+        Observed data as returned by prepare_fit_data. If None, it will be
+        calculated from obs_flux, obs_flux_err, and obs_limits.
 
     Returns
     -------
     log_prob : float
-        Log-probability of the model given the observed data
+        Log-probability of the model given the observed data, up to an additive constant
     """
 
     # First check the prior
@@ -624,14 +905,127 @@ def log_probability(theta, obs_wave, obs_flux, obs_flux_err, obs_limits,
     if not np.isfinite(lp):
         return -np.inf
 
-    # If prior is finite, add log-likelihood
+    # If prior is finite, add log-likelihood without its constant normalization
     return lp + log_likelihood(theta, obs_wave, obs_flux, obs_flux_err, obs_limits,
                                kappa_interp, redshift, distance, radius, n_components,
                                obs_wave_filters, obs_trans_filters, kappa_interp_hot,
-                               kappa_interp_cold, kappa_interp_warm, dust_type, add_sigma)
+                               kappa_interp_cold, kappa_interp_warm, dust_type, add_sigma, filter_weights,
+                               fit_data, normalize=False)
+
+
+def log_probability_batch(thetas, obs_wave, obs_flux, obs_flux_err, obs_limits,
+                          kappa_interp, redshift, distance, radius=None, n_components=1,
+                          obs_wave_filters=None, obs_trans_filters=None,
+                          kappa_interp_hot=None, kappa_interp_cold=None,
+                          kappa_interp_warm=None, dust_type='thin',
+                          flat_mass_prior=True, priors=None, add_sigma=True, filter_weights=None,
+                          fit_data=None):
+    """
+    Calculate the log-probability of a batch of walkers in a single
+    vectorized call, for use with emcee's vectorize=True option. Takes the
+    same arguments as log_probability.
+
+    Parameters
+    ----------
+    thetas : 2D array
+        Parameters of each walker, with shape (n_walkers, n_dim)
+    obs_wave, obs_flux, obs_flux_err, obs_limits, kappa_interp, redshift, distance, radius,
+    n_components, obs_wave_filters, obs_trans_filters, kappa_interp_hot, kappa_interp_cold,
+    kappa_interp_warm, dust_type, flat_mass_prior, priors, add_sigma, filter_weights, fit_data :
+        See log_probability
+
+    Returns
+    -------
+    log_prob : array
+        Log-probability of each walker
+    """
+
+    thetas = np.atleast_2d(thetas)
+
+    # Walkers outside of the prior are not evaluated
+    lp = log_prior_batch(thetas, priors, n_components, flat_mass_prior, add_sigma=add_sigma)
+    log_prob = np.full(len(thetas), -np.inf)
+    good = np.isfinite(lp)
+    if not np.any(good):
+        return log_prob
 
+    # Calculate model flux of all remaining walkers at once as a plain array in Jy
+    if add_sigma:
+        thetas_use, sigma = thetas[good, :-1], 10 ** thetas[good, -1]
+    else:
+        thetas_use, sigma = thetas[good], 0
+    flux_model = model_flux_batch(thetas_use, obs_wave, kappa_interp, redshift, distance, radius, n_components,
+                                  obs_wave_filters=obs_wave_filters, obs_trans_filters=obs_trans_filters,
+                                  kappa_interp_hot=kappa_interp_hot, kappa_interp_cold=kappa_interp_cold,
+                                  kappa_interp_warm=kappa_interp_warm, dust_type=dust_type,
+                                  filter_weights=filter_weights, unitless=True)
 
-def no_warnings(sampler, pos, n_steps, emcee_progress=True):
+    # Add log-likelihood without its constant normalization
+    if fit_data is None:
+        fit_data = prepare_fit_data(obs_flux, obs_flux_err, obs_limits)
+    log_prob[good] = lp[good] + calc_ln_like(flux_model, fit_data, sigma, normalize=False)
+
+    return log_prob
+
+
+# Static arguments of log_probability in each worker process
+_lnprob_state = {}
+
+
+def _process_context():
+    """
+    Multiprocessing context that starts workers from a forkserver which
+    already imported dustysn, or spawns them where forkserver is not available.
+
+    Returns
+    -------
+    ctx : multiprocessing.context.BaseContext
+        Context used to create process pools
+    """
+
+    try:
+        ctx = mp.get_context('forkserver')
+        ctx.set_forkserver_preload(['numpy', 'astropy.units', 'dustysn.model'])
+    except ValueError:
+        ctx = mp.get_context('spawn')
+
+    return ctx
+
+
+def _init_worker(args):
+    """
+    Store the static arguments of log_probability in a worker process,
+    so they are sent once when the pool starts instead of with every task.
+
+    Parameters
+    ----------
+    args : tuple
+        Arguments of log_probability after theta
+    """
+
+    _lnprob_state['args'] = args
+
+
+def _log_probability_worker(theta):
+    """
+    Calculate the log-probability of a walker with the arguments
+    stored by _init_worker.
+
+    Parameters
+    ----------
+    theta : array
+        Parameters of the walker
+
+    Returns
+    -------
+    log_prob : float
+        Log-probability of the walker
+    """
+
+    return log_probability(theta, *_lnprob_state['args'])
+
+
+def no_warnings(sampler, pos, n_steps, emcee_progress=True, thin_by=1):
     """
     Run MCMC sampler while ignoring specific warnings.
 
@@ -645,6 +1039,9 @@ def no_warnings(sampler, pos, n_steps, emcee_progress=True):
         Number of steps to take
     emcee_progress : bool, optional
         Whether to show progress bar (default: True)
+    thin_by : int, optional
+        Only store every thin_by-th step, the total number of steps taken
+        is still n_steps (default: 1)
 
     Returns:
     -------
@@ -667,12 +1064,13 @@ def no_warnings(sampler, pos, n_steps, emcee_progress=True):
                                 message="invalid value encountered in double_scalars")
 
         # Run the sampler and return its result
-        sampler.run_mcmc(pos, n_steps, progress=emcee_progress)
+        sampler.run_mcmc(pos, n_steps // thin_by, thin_by=thin_by, progress=emcee_progress)
 
     return sampler
 
 
-def mcmc_with_sigma_clipping(sampler, pos, n_steps, sigma_clip=2.0, repeats=3, emcee_progress=True):
+def mcmc_with_sigma_clipping(sampler, pos, n_steps, sigma_clip=2.0, repeats=3, emcee_progress=True, rng=rng,
+                             thin_by=1):
     """
     Run MCMC with sigma clipping to help convergence.
 
@@ -693,6 +1091,10 @@ def mcmc_with_sigma_clipping(sampler, pos, n_steps, sigma_clip=2.0, repeats=3, e
         Number of times to repeat the MCMC process with sigma clipping
     emcee_progress : bool, default=True
         Whether to display progress bar
+    rng : numpy.random.Generator, optional
+        Random number generator used to redraw walkers
+    thin_by : int, default=1
+        Only store every thin_by-th step of each run
 
     Returns
     -------
@@ -702,14 +1104,14 @@ def mcmc_with_sigma_clipping(sampler, pos, n_steps, sigma_clip=2.0, repeats=3, e
     n_walkers, n_dim = pos.shape
 
     # First run
-    sampler = no_warnings(sampler, pos, n_steps, emcee_progress=emcee_progress)
+    sampler = no_warnings(sampler, pos, n_steps, emcee_progress=emcee_progress, thin_by=thin_by)
 
     # Repeat the process if requested
     for i in range(repeats - 1):
         print(f"Starting MCMC run {i + 2} of {repeats}...")
 
         # Get the last positions
-        last_pos = sampler.chain[:, -1, :]
+        last_pos = sampler.get_last_sample().coords.copy()
 
         # Check for invalid values in the last position
         invalid_mask = np.any(~np.isfinite(last_pos), axis=1)
@@ -719,9 +1121,9 @@ def mcmc_with_sigma_clipping(sampler, pos, n_steps, sigma_clip=2.0, repeats=3, e
             valid_indices = np.where(~invalid_mask)[0]
 
             # Replace invalid walkers with valid ones plus some noise
-            for idx in np.where(invalid_mask)[0]:
-                valid_idx = np.random.choice(valid_indices)
-                last_pos[idx] = last_pos[valid_idx] + np.random.normal(0, 1e-4, n_dim)
+            invalid_indices = np.where(invalid_mask)[0]
+            picks = rng.choice(valid_indices, size=len(invalid_indices))
+            last_pos[invalid_indices] = last_pos[picks] + rng.normal(0, 1e-4, size=(len(invalid_indices), n_dim))
 
         # Calculate the median and std for each parameter
         medians = np.median(last_pos, axis=0)
@@ -743,20 +1145,16 @@ def mcmc_with_sigma_clipping(sampler, pos, n_steps, sigma_clip=2.0, repeats=3, e
             new_pos = np.copy(last_pos)
             invalid_indices = np.where(~valid_walkers)[0]
 
-            for idx in invalid_indices:
-                # Sample a valid walker
-                valid_idx = np.random.choice(valid_indices)
-                # Copy position but add some noise within the acceptable range
-                for dim in range(n_dim):
-                    new_pos[idx, dim] = last_pos[valid_idx, dim] + \
-                                      np.random.normal(0, stds[dim] / sigma_clip)
+            # Copy the positions of random valid walkers and add some noise within the acceptable range
+            picks = rng.choice(valid_indices, size=len(invalid_indices))
+            new_pos[invalid_indices] = last_pos[picks] + rng.normal(0, stds / sigma_clip, size=(len(invalid_indices), n_dim))
 
             # Run the next iteration with the new positions
             with warnings.catch_warnings():
                 warnings.filterwarnings("ignore", category=RuntimeWarning,
                                         message="invalid value encountered in scalar subtract",
                                         module="emcee.moves.red_blue")
-                sampler = no_warnings(sampler, new_pos, n_steps, emcee_progress=emcee_progress)
+                sampler = no_warnings(sampler, new_pos, n_steps, emcee_progress=emcee_progress, thin_by=thin_by)
         else:
             print("All walkers are within the specified sigma range.")
             # Still run the next iteration with the last positions
@@ -764,7 +1162,7 @@ def mcmc_with_sigma_clipping(sampler, pos, n_steps, sigma_clip=2.0, repeats=3, e
                 warnings.filterwarnings("ignore", category=RuntimeWarning,
                                         message="invalid value encountered in scalar subtract",
                                         module="emcee.moves.red_blue")
-                sampler = no_warnings(sampler, last_pos, n_steps, emcee_progress=emcee_progress)
+                sampler = no_warnings(sampler, last_pos, n_steps, emcee_progress=emcee_progress, thin_by=thin_by)
 
     return sampler
 
@@ -872,8 +1270,7 @@ def plot_model(object_name, last_samples, results, obs_wave, obs_flux, obs_flux_
                 s=80, label='Filter Integrated Model', zorder=2, alpha=0.7)
 
     # Fine grid for smooth model curve
-    wave_dense = np.logspace(np.log10(obs_wave.value.min()*0.5),
-                             np.log10(obs_wave.value.max()*1.5), 200) * u.micron
+    wave_dense = np.geomspace(obs_wave.value.min()*0.5, obs_wave.value.max()*1.5, 200) * u.micron
 
     # If the hot and cold components have different compositions
     if kappa_cold is None:
@@ -1165,27 +1562,25 @@ def plot_model(object_name, last_samples, results, obs_wave, obs_flux, obs_flux_
                  label=hot_label)
 
     # Visualize uncertainty
-    # Calculate model for a range of samples to create confidence interval
-    model_values = np.zeros((len(last_samples), len(wave_dense)))
+    # Calculate model for all samples at once to create confidence interval
+    if add_sigma:
+        sample_params = np.asarray(last_samples)[:, :-1]
+    else:
+        sample_params = np.asarray(last_samples)
+    model_values = model_flux_batch(sample_params, wave_dense, kappa_dense_hot, redshift, distance, radius, n_components,
+                                    kappa_interp_hot=kappa_dense_hot, kappa_interp_cold=kappa_dense_cold,
+                                    kappa_interp_warm=kappa_dense_warm, dust_type=dust_type).value
 
-    for i, idx in enumerate(last_samples):
-        if add_sigma:
-            sample_model = model_flux(idx[:-1], wave_dense, obs_flux, kappa_dense_hot, redshift, distance, radius, n_components,
-                                      kappa_interp_hot=kappa_dense_hot, kappa_interp_cold=kappa_dense_cold, kappa_interp_warm=kappa_dense_warm,
-                                      dust_type=dust_type)
-        else:
-            sample_model = model_flux(idx, wave_dense, obs_flux, kappa_dense_hot, redshift, distance, radius, n_components,
-                                      kappa_interp_hot=kappa_dense_hot, kappa_interp_cold=kappa_dense_cold, kappa_interp_warm=kappa_dense_warm,
-                                      dust_type=dust_type)
-        model_values[i] = sample_model.value
-        plt.plot(wave_dense.value, sample_model.value, linewidth=0.1, color='green', alpha=0.1)
+    # Draw all the sample models as a single collection
+    segments = np.stack([np.broadcast_to(wave_dense.value, model_values.shape), model_values], axis=-1)
+    plt.gca().add_collection(LineCollection(segments, linewidths=0.1, colors='green', alpha=0.1))
 
     # Calculate percentiles for lower and upper bounds
     lower_bound, upper_bound = np.percentile(model_values, [15.87, 84.13], axis=0)
 
     # Determine the optimal y-axis limits
-    ymin = 10 ** (np.log10(np.nanmin(obs_flux.value)) - 0.2)
-    ymax = 10 ** (np.log10(np.nanmax(obs_flux.value)) + 0.2)
+    ymin = np.nanmin(obs_flux.value) * 10 ** -0.2
+    ymax = np.nanmax(obs_flux.value) * 10 ** 0.2
 
     # Determine the optimal x-axis limits
     xmin = np.min([5, np.min(obs_wave.value) * 0.9])
@@ -1215,7 +1610,7 @@ def fit_dust_model(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
                    n_filter_samples=1000, plot=False, plots_model=False, plots_corner=False, plots_trace=False,
                    output_dir='.', initial_pos=None, priors=None, composition_hot=None, composition_cold=None,
                    composition_warm=None, dust_type='thin', radius=None, flat_mass_prior=True, add_sigma=True,
-                   distance=None):
+                   distance=None, thin_by=1, backend_path=None, moves=None):
     """
     Run MCMC sampler without multiprocessing.
 
@@ -1246,7 +1641,9 @@ def fit_dust_model(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
     burn_in : float
         Fraction of steps to discard as burn-in
     n_cores : int
-        Number of threads
+        Number of threads, or processes if numba is not installed. Processes are
+        started with forkserver or spawn, so scripts that call this function with
+        n_cores > 1 must protect their entry point with if __name__ == "__main__":
     sigma_clip : float
         Number of sigma to clip walkers at between runs
     repeats : int
@@ -1289,6 +1686,15 @@ def fit_dust_model(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
         If True, add an additional variance to the uncertainties defined by the sigma parameter.
     distance : Quantity, optional
         Luminosity distance in astropy units. If None, it will be calculated from the redshift
+    thin_by : int, default 1
+        Only store every thin_by-th step of the chain to reduce memory, n_steps
+        must be a multiple of thin_by
+    backend_path : str, optional
+        If provided, store the chain in an HDF5 file at this path instead of
+        in memory, requires h5py
+    moves : list, optional
+        emcee moves and their weights used by the sampler. By default an even
+        mix of emcee's differential evolution and stretch moves is used
 
     Returns
     -------
@@ -1297,12 +1703,18 @@ def fit_dust_model(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
     samples : array
         MCMC samples
     """
-    # Number of parameters
-    np.random.seed(42)
+    # Seeded generator for the initial walkers, the sampler, and the walker redraws, so
+    # that fits are reproducible without changing the global NumPy random state
+    rng = np.random.default_rng(42)
+
+    # Number of stored steps per run
+    if n_steps % thin_by != 0:
+        raise ValueError(f"n_steps ({n_steps}) must be a multiple of thin_by ({thin_by}).")
+    n_saved = n_steps // thin_by
 
     # Calculate the distance in cm
     if distance is None:
-        distance = calc_distance(redshift)
+        distance = calc_distance(redshift).to(u.cm).value
     elif isinstance(distance, u.Quantity):
         distance = distance.to(u.cm).value
     else:
@@ -1333,234 +1745,155 @@ def fit_dust_model(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
                                                       interp_grain=False)
 
     if obs_wave_filters is not None:
-        # Pre-calculate interpolated opacities for the filter wavelengths
+        # Sample the model on a grid that covers all the filters
         mins, maxs = np.array([(np.min(i), np.max(i)) for i in obs_wave_filters]).T
         min_wave = np.min(mins)
         max_wave = np.max(maxs)
         sampled_waves = np.linspace(min_wave, max_wave, n_filter_samples)
-        rest_wave = sampled_waves / (1 + redshift) * u.micron
-        kappa_interp = interpolate_kappa(wave_kappa, kappa, rest_wave)
-        kappa_interp_hot = interpolate_kappa(wave_kappa_hot, kappa_hot, rest_wave)
-        kappa_interp_cold = interpolate_kappa(wave_kappa_cold, kappa_cold, rest_wave)
-        kappa_interp_warm = interpolate_kappa(wave_kappa_warm, kappa_warm, rest_wave)
         obs_wave_samples = sampled_waves * u.micron
+
+        # Pre-calculate the filter integration weights, with only a few filters
+        # a dense matrix is faster to multiply than the sparse one
+        filter_weights = calc_filter_weights(sampled_waves, obs_wave_filters, obs_trans_filters).toarray()
     else:
-        # Pre-calculate interpolated opacities for the reference wavelengths
-        rest_wave = obs_wave / (1 + redshift)
-        kappa_interp = interpolate_kappa(wave_kappa, kappa, rest_wave)
-        kappa_interp_hot = interpolate_kappa(wave_kappa_hot, kappa_hot, rest_wave)
-        kappa_interp_cold = interpolate_kappa(wave_kappa_cold, kappa_cold, rest_wave)
-        kappa_interp_warm = interpolate_kappa(wave_kappa_warm, kappa_warm, rest_wave)
+        # Sample the model at the observed wavelengths
         obs_wave_samples = obs_wave
-
-    # Set up initial positions for walkers
-    def create_prior(n_walkers, initial_pos):
-        if n_components == 1:
-            log_dust_mass_cold = np.random.uniform(initial_pos['log_dust_mass_cold'][0],
-                                                   initial_pos['log_dust_mass_cold'][1], n_walkers)
-            temp_cold = np.random.uniform(initial_pos['temp_cold'][0],
-                                          initial_pos['temp_cold'][1], n_walkers)
-            if add_sigma:
-                log_sigma = np.random.uniform(initial_pos['sigma'][0],
-                                              initial_pos['sigma'][1], n_walkers)
-                pos = np.array([log_dust_mass_cold, temp_cold, log_sigma]).T
-            else:
-                pos = np.array([log_dust_mass_cold, temp_cold]).T
-            return pos
-        elif n_components == 2:
-            log_dust_mass_cold = np.random.uniform(initial_pos['log_dust_mass_cold'][0],
-                                                   initial_pos['log_dust_mass_cold'][1], n_walkers)
-            temp_cold = np.random.uniform(initial_pos['temp_cold'][0],
-                                          initial_pos['temp_cold'][1], n_walkers)
-            log_dust_mass_hot = np.random.uniform(initial_pos['log_dust_mass_hot'][0],
-                                                  initial_pos['log_dust_mass_hot'][1], n_walkers)
-            temp_hot = np.random.uniform(initial_pos['temp_hot'][0],
-                                         initial_pos['temp_hot'][1], n_walkers)
-            if add_sigma:
-                log_sigma = np.random.uniform(initial_pos['sigma'][0],
-                                              initial_pos['sigma'][1], n_walkers)
-                pos = np.array([log_dust_mass_cold, temp_cold, log_dust_mass_hot,
-                                temp_hot, log_sigma]).T
-            else:
-                pos = np.array([log_dust_mass_cold, temp_cold, log_dust_mass_hot,
-                                temp_hot]).T
-            return pos
-        elif n_components == 3:
-            log_dust_mass_cold = np.random.uniform(initial_pos['log_dust_mass_cold'][0],
-                                                   initial_pos['log_dust_mass_cold'][1], n_walkers)
-            temp_cold = np.random.uniform(initial_pos['temp_cold'][0],
-                                          initial_pos['temp_cold'][1], n_walkers)
-            log_dust_mass_hot = np.random.uniform(initial_pos['log_dust_mass_hot'][0],
-                                                  initial_pos['log_dust_mass_hot'][1], n_walkers)
-            temp_hot = np.random.uniform(initial_pos['temp_hot'][0],
-                                         initial_pos['temp_hot'][1], n_walkers)
-            log_dust_mass_warm = np.random.uniform(initial_pos['log_dust_mass_warm'][0],
-                                                   initial_pos['log_dust_mass_warm'][1], n_walkers)
-            temp_warm = np.random.uniform(initial_pos['temp_warm'][0],
-                                          initial_pos['temp_warm'][1], n_walkers)
-            if add_sigma:
-                log_sigma = np.random.uniform(initial_pos['sigma'][0],
-                                              initial_pos['sigma'][1], n_walkers)
-                pos = np.array([log_dust_mass_cold, temp_cold, log_dust_mass_hot, temp_hot,
-                                log_dust_mass_warm, temp_warm, log_sigma]).T
-            else:
-                pos = np.array([log_dust_mass_cold, temp_cold, log_dust_mass_hot, temp_hot,
-                                log_dust_mass_warm, temp_warm]).T
-            return pos
-
-        else:
-            raise ValueError("n_components must be 1, 2, or 3")
+        filter_weights = None
+
+    # Pre-calculate interpolated opacities once, the sampler never re-interpolates them.
+    # Components share the grain size, so each distinct composition is only interpolated once
+    rest_wave = obs_wave_samples / (1 + redshift)
+    kappa_interps = {}
+    for comp, wave_kappa_comp, kappa_comp in [(composition, wave_kappa, kappa), (composition_hot, wave_kappa_hot, kappa_hot),
+                                              (composition_cold, wave_kappa_cold, kappa_cold),
+                                              (composition_warm, wave_kappa_warm, kappa_warm)]:
+        if comp not in kappa_interps:
+            # Strip units once, so the MCMC only handles plain float arrays
+            # in microns and cm^2/g and never has to convert units
+            kappa_comp = interpolate_kappa(wave_kappa_comp, kappa_comp, rest_wave)
+            kappa_interps[comp] = np.ascontiguousarray(kappa_comp.to(u.cm**2 / u.g).value, dtype=float)
+    kappa_interp = kappa_interps[composition]
+    kappa_interp_hot = kappa_interps[composition_hot]
+    kappa_interp_cold = kappa_interps[composition_cold]
+    kappa_interp_warm = kappa_interps[composition_warm]
+    obs_wave_samples = np.ascontiguousarray(obs_wave_samples.to(u.micron).value, dtype=float)
 
     if priors is None:
         priors = ref_priors
     if initial_pos is None:
         initial_pos = priors
 
-    # Create initial positions
-    pos_in = create_prior(n_walkers, initial_pos)
-    pos_out = pos_in[0:1]
-    while len(pos_out) < n_walkers:
-        pos = pos_in[[np.isfinite(log_prior(i, priors, n_components=n_components, add_sigma=add_sigma)) for i in pos_in]]
-        pos_out = np.append(pos_out, pos, axis=0)
-
-    # Crop to correct length
-    if len(pos_out) != n_walkers:
-        pos = pos_out[1:n_walkers+1]
+    # Bounds of the initial positions for walkers
+    names = _param_names(n_components, add_sigma)
+    pos_lo = np.array([initial_pos[name][0] for name in names])
+    pos_hi = np.array([initial_pos[name][1] for name in names])
+
+    # Draw initial positions and keep the ones inside the prior, giving up if
+    # the initial positions and the prior do not overlap
+    pos_chunks = []
+    n_valid = 0
+    for i in range(100):
+        pos_in = rng.uniform(pos_lo, pos_hi, size=(4 * n_walkers, len(names)))
+        pos = pos_in[np.isfinite(log_prior_batch(pos_in, priors, n_components, add_sigma=add_sigma))]
+        pos_chunks.append(pos)
+        n_valid += len(pos)
+        if n_valid >= n_walkers:
+            break
     else:
-        pos = pos_out
+        bounds = ', '.join(f"{name}: initial_pos {tuple(initial_pos[name])}, priors {tuple(priors[name])}" for name in names)
+        raise ValueError(f"Could not draw {n_walkers} initial walkers within the prior, only {n_valid} were valid. "
+                         f"Check that the initial_pos and priors bounds overlap ({bounds}).")
+
+    # Join and crop to correct length
+    pos = np.concatenate(pos_chunks, axis=0)[:n_walkers]
+
+    # Pack the observed data for the likelihood
+    fit_data = prepare_fit_data(obs_flux, obs_flux_err, obs_limits)
 
-    # Set up arguments for the log-probability function
-    args = (obs_wave_samples, obs_flux, obs_flux_err, obs_limits, kappa_interp, redshift, distance, radius,
-            n_components, obs_wave_filters, obs_trans_filters, kappa_interp_hot, kappa_interp_cold, kappa_interp_warm, dust_type,
-            flat_mass_prior, priors, add_sigma)
+    # Pass only plain floats and arrays in Jy and cm to the log-probability function
+    obs_flux_jy = obs_flux.to(u.Jy).value if isinstance(obs_flux, u.Quantity) else np.asarray(obs_flux, dtype=float)
+    obs_flux_err_jy = obs_flux_err.to(u.Jy).value if isinstance(obs_flux_err, u.Quantity) else np.asarray(obs_flux_err, dtype=float)
+    radius_cm = radius.to(u.cm).value if isinstance(radius, u.Quantity) else radius
+    args = (obs_wave_samples, obs_flux_jy, obs_flux_err_jy, np.asarray(obs_limits, dtype=bool), kappa_interp, float(redshift),
+            distance, radius_cm, n_components, obs_wave_filters, obs_trans_filters, kappa_interp_hot, kappa_interp_cold,
+            kappa_interp_warm, dust_type, flat_mass_prior, priors, add_sigma, filter_weights, fit_data)
 
     # Run MCMC without multiprocessing
     n_dim = pos.shape[1]
-    # Create a multiprocessing pool if n_cores > 1
+
+    # Store the chain on disk if requested
+    if backend_path is not None:
+        backend = emcee.backends.HDFBackend(backend_path)
+        backend.reset(n_walkers, n_dim)
+    else:
+        backend = None
+
+    # Mix differential evolution moves, whose proposals follow the spread of the
+    # walkers in each parameter, with the default stretch move
+    if moves is None:
+        moves = [(emcee.moves.DEMove(), 0.5), (emcee.moves.StretchMove(), 0.5)]
+
+    # emcee draws its proposals from a legacy RandomState, seed it from the generator
+    sampler_state = np.random.RandomState(rng.integers(2**32)).get_state()
+
+    # Create a pool if n_cores > 1, the compiled kernels release the GIL so threads
+    # avoid the pickling overhead of processes, otherwise use multiprocessing
     if n_cores > 1:
-        with Pool(processes=n_cores) as pool:
-            sampler = emcee.EnsembleSampler(n_walkers, n_dim, log_probability, args=args, pool=pool)
+        if has_numba:
+            pool_context = ThreadPoolExecutor(max_workers=n_cores)
+            lnprob_fn, lnprob_args = log_probability, args
+        else:
+            # Each worker receives the static arguments once, so only theta is pickled per task
+            pool_context = _process_context().Pool(processes=n_cores, initializer=_init_worker, initargs=(args,))
+            lnprob_fn, lnprob_args = _log_probability_worker, None
+        with pool_context as pool:
+            sampler = emcee.EnsembleSampler(n_walkers, n_dim, lnprob_fn, args=lnprob_args, pool=pool, moves=moves,
+                                            backend=backend)
+            sampler.random_state = sampler_state
 
             # Show progress bar during sampling
             print("Running MCMC with parallel processing using", n_cores, "cores...")
             sampler = mcmc_with_sigma_clipping(sampler, pos, n_steps,
                                                sigma_clip=sigma_clip,
                                                repeats=repeats,
-                                               emcee_progress=emcee_progress)
+                                               emcee_progress=emcee_progress,
+                                               rng=rng,
+                                               thin_by=thin_by)
     else:
-        # Use the existing non-parallel approach if n_cores=1
-        sampler = emcee.EnsembleSampler(n_walkers, n_dim, log_probability, args=args)
+        # Without a pool, evaluate all walkers of each step in a single vectorized call
+        sampler = emcee.EnsembleSampler(n_walkers, n_dim, log_probability_batch, args=args, vectorize=True,
+                                        moves=moves, backend=backend)
+        sampler.random_state = sampler_state
 
         # Show progress bar during sampling
         print("Running MCMC without parallel processing...")
         sampler = mcmc_with_sigma_clipping(sampler, pos, n_steps,
                                            sigma_clip=sigma_clip,
                                            repeats=repeats,
-                                           emcee_progress=emcee_progress)
+                                           emcee_progress=emcee_progress,
+                                           rng=rng,
+                                           thin_by=thin_by)
 
     # Only consider the last bit of the chain for parameter estimation
     if repeats > 1:
-        samples_crop = sampler.chain[:, -n_steps:].reshape((-1, n_dim))
+        samples_crop = sampler.get_chain(discard=sampler.iteration - n_saved, flat=True)
     else:
-        samples_crop = sampler.chain[:, -int(n_steps*(1-burn_in)):, :].reshape((-1, n_dim))
-    last_samples = sampler.chain[:, -1, :]
-
-    # Obtain the parametrs of the best fit
-    if n_components == 1:
-        if add_sigma:
-            log_dust_mass_cold_mcmc, temp_cold_mcmc, sigma_mcmc = map(lambda v: (v[1], v[2]-v[1], v[1]-v[0]),
-                                                                      zip(*np.percentile(samples_crop, [15.87, 50, 84.13], axis=0)))
-        else:
-            log_dust_mass_cold_mcmc, temp_cold_mcmc = map(lambda v: (v[1], v[2]-v[1], v[1]-v[0]),
-                                                          zip(*np.percentile(samples_crop, [15.87, 50, 84.13], axis=0)))
-        # Calculate total dust mass
-        total_dust_mass_samples = 10 ** samples_crop[:, 0]
-        total_dust_mass_percentiles = np.percentile(total_dust_mass_samples, [15.87, 50, 84.13], axis=0)
-        total_dust_mass_mcmc = (total_dust_mass_percentiles[1],
-                                total_dust_mass_percentiles[2] - total_dust_mass_percentiles[1],
-                                total_dust_mass_percentiles[1] - total_dust_mass_percentiles[0])
-        if add_sigma:
-            results = {
-                'log_dust_mass_cold': log_dust_mass_cold_mcmc,
-                'temp_cold': temp_cold_mcmc,
-                'total_dust_mass': total_dust_mass_mcmc,
-                'sigma': sigma_mcmc
-            }
-        else:
-            results = {
-                'log_dust_mass_cold': log_dust_mass_cold_mcmc,
-                'temp_cold': temp_cold_mcmc,
-                'total_dust_mass': total_dust_mass_mcmc
-            }
-    elif n_components == 2:
-        if add_sigma:
-            log_dust_mass_cold_mcmc, temp_cold_mcmc, log_dust_mass_hot_mcmc, temp_hot_mcmc, sigma_mcmc = \
-                map(lambda v: (v[1], v[2]-v[1], v[1]-v[0]),
-                    zip(*np.percentile(samples_crop, [15.87, 50, 84.13], axis=0)))
-        else:
-            log_dust_mass_cold_mcmc, temp_cold_mcmc, log_dust_mass_hot_mcmc, temp_hot_mcmc = \
-                map(lambda v: (v[1], v[2]-v[1], v[1]-v[0]),
-                    zip(*np.percentile(samples_crop, [15.87, 50, 84.13], axis=0)))
-        # Calculate total dust mass
-        total_dust_mass_samples = 10 ** samples_crop[:, 0] + 10 ** samples_crop[:, 2]
-        total_dust_mass_percentiles = np.percentile(total_dust_mass_samples, [15.87, 50, 84.13], axis=0)
-        total_dust_mass_mcmc = (total_dust_mass_percentiles[1],
-                                total_dust_mass_percentiles[2] - total_dust_mass_percentiles[1],
-                                total_dust_mass_percentiles[1] - total_dust_mass_percentiles[0])
-        if add_sigma:
-            results = {
-                'log_dust_mass_cold': log_dust_mass_cold_mcmc,
-                'temp_cold': temp_cold_mcmc,
-                'log_dust_mass_hot': log_dust_mass_hot_mcmc,
-                'temp_hot': temp_hot_mcmc,
-                'total_dust_mass': total_dust_mass_mcmc,
-                'sigma': sigma_mcmc
-            }
-        else:
-            results = {
-                'log_dust_mass_cold': log_dust_mass_cold_mcmc,
-                'temp_cold': temp_cold_mcmc,
-                'log_dust_mass_hot': log_dust_mass_hot_mcmc,
-                'temp_hot': temp_hot_mcmc,
-                'total_dust_mass': total_dust_mass_mcmc
-            }
-    elif n_components == 3:
-        if add_sigma:
-            (log_dust_mass_cold_mcmc, temp_cold_mcmc, log_dust_mass_hot_mcmc, temp_hot_mcmc,
-             log_dust_mass_warm_mcmc, temp_warm_mcmc, sigma_mcmc) = \
-                map(lambda v: (v[1], v[2]-v[1], v[1]-v[0]),
-                    zip(*np.percentile(samples_crop, [15.87, 50, 84.13], axis=0)))
-        else:
-            log_dust_mass_cold_mcmc, temp_cold_mcmc, log_dust_mass_hot_mcmc, temp_hot_mcmc, log_dust_mass_warm_mcmc, temp_warm_mcmc = \
-                map(lambda v: (v[1], v[2]-v[1], v[1]-v[0]),
-                    zip(*np.percentile(samples_crop, [15.87, 50, 84.13], axis=0)))
-        # Calculate total dust mass
-        total_dust_mass_samples = 10 ** samples_crop[:, 0] + 10 ** samples_crop[:, 2] + 10 ** samples_crop[:, 4]
-        total_dust_mass_percentiles = np.percentile(total_dust_mass_samples, [15.87, 50, 84.13], axis=0)
-        total_dust_mass_mcmc = (total_dust_mass_percentiles[1],
-                                total_dust_mass_percentiles[2] - total_dust_mass_percentiles[1],
-                                total_dust_mass_percentiles[1] - total_dust_mass_percentiles[0])
-        if add_sigma:
-            results = {
-                'log_dust_mass_cold': log_dust_mass_cold_mcmc,
-                'temp_cold': temp_cold_mcmc,
-                'log_dust_mass_hot': log_dust_mass_hot_mcmc,
-                'temp_hot': temp_hot_mcmc,
-                'log_dust_mass_warm': log_dust_mass_warm_mcmc,
-                'temp_warm': temp_warm_mcmc,
-                'total_dust_mass': total_dust_mass_mcmc,
-                'sigma': sigma_mcmc
-            }
-        else:
-            results = {
-                'log_dust_mass_cold': log_dust_mass_cold_mcmc,
-                'temp_cold': temp_cold_mcmc,
-                'log_dust_mass_hot': log_dust_mass_hot_mcmc,
-                'temp_hot': temp_hot_mcmc,
-                'log_dust_mass_warm': log_dust_mass_warm_mcmc,
-                'temp_warm': temp_warm_mcmc,
-                'total_dust_mass': total_dust_mass_mcmc
-            }
+        samples_crop = sampler.get_chain(discard=sampler.iteration - int(n_saved*(1-burn_in)), flat=True)
+    last_samples = sampler.get_last_sample().coords.copy()
+
+    # Calculate the percentiles of all parameters and the total dust mass in a single call,
+    # with the total dust mass placed after the component parameters and before sigma
+    n_mass = 2 * n_components
+    total_dust_mass_samples = np.sum(10 ** samples_crop[:, 0:n_mass:2], axis=1)
+    percentiles = np.quantile(np.column_stack([samples_crop[:, :n_mass], total_dust_mass_samples, samples_crop[:, n_mass:]]),
+                              [0.1587, 0.5, 0.8413], axis=0)
+    medians = percentiles[1]
+    upper = percentiles[2] - percentiles[1]
+    lower = percentiles[1] - percentiles[0]
+
+    # Obtain the parameters of the best fit
+    result_names = names[:n_mass] + ['total_dust_mass'] + names[n_mass:]
+    results = {name: (medians[i], upper[i], lower[i]) for i, name in enumerate(result_names)}
 
     # Make sure the directory exists
     os.makedirs(output_dir, exist_ok=True)
@@ -1590,9 +1923,11 @@ def fit_dust_model(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
             params = list(results.keys())[:-2] + [list(results.keys())[-1]]
         else:
             params = list(results.keys())[:-1]
+        # Read the chain once, with shape (n_walkers, n_steps, n_dim)
+        chain = np.swapaxes(sampler.get_chain(), 0, 1)
         for i, param in enumerate(params):
             is_log = False
-            plot_trace(sampler.chain[:, :, i],
+            plot_trace(chain[:, :, i],
                        results[param],
                        results[param],
                        priors[param][0],
@@ -1600,29 +1935,17 @@ def fit_dust_model(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
                        f"{param}",
                        f"{param}",
                        is_log,
-                       n_steps,
+                       n_saved,
                        burn_in,
                        repeats,
                        object_name,
                        n_components,
                        output_dir=output_dir)
 
-    # Create lists for the table columns
-    parameters = []
-    median_values = []
-    upper_values = []
-    lower_values = []
-
-    # Extract data from the dictionary
-    for parameter, values in results.items():
-        parameters.append(parameter)
-        median_values.append(values[0])
-        upper_values.append(values[1])
-        lower_values.append(values[2])
-
-    # Create Astropy Table
-    output_table = table.Table([parameters, median_values, upper_values, lower_values],
-                               names=('parameter', 'median', 'upper', 'lower'))
+    # Create Astropy Table with one row per parameter
+    values = np.array(list(results.values()))
+    output_table = table.Table({'parameter': list(results.keys()), 'median': values[:, 0], 'upper': values[:, 1],
+                                'lower': values[:, 2]})
     output_filename = os.path.join(output_dir, f'parameters_{object_name}_{n_components}.txt')
     output_table.write(output_filename, format='ascii', overwrite=True)
 
@@ -1652,10 +1975,10 @@ def compare_models(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
         Name of the object being fitted
     results_1 : dict
         Dictionary with the results of the 1-component MCMC fit
-    results_2 : dict
-        Dictionary with the results of the 2-component MCMC fit
-    results_3 : dict
-        Dictionary with the results of the 3-component MCMC fit
+    results_2 : dict or None
+        Dictionary with the results of the 2-component MCMC fit, None if it was not fit
+    results_3 : dict or None
+        Dictionary with the results of the 3-component MCMC fit, None if it was not fit
     grain_size : float, default 0.1
         Grain size in microns
     obs_wave_filters : list of arrays
@@ -1699,23 +2022,25 @@ def compare_models(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
     else:
         raise ValueError(f"distance must be an astropy Quantity or None, not {type(distance)}")
 
-    # Interpolate kappa for the cold component (1 component model)
-    wave_kappa_cold, kappa_cold = import_coefficients(grain_size=grain_size, composition=composition_cold,
-                                                      interp_grain=False)
-    obs_wave_rest_cold = obs_wave / (1 + redshift)
-    kappa_interp_cold = interpolate_kappa(wave_kappa_cold, kappa_cold, obs_wave_rest_cold)
-
-    # Interpolate kappa for the hot component (2 component model)
-    wave_kappa_hot, kappa_hot = import_coefficients(grain_size=grain_size, composition=composition_hot,
-                                                    interp_grain=False)
-    obs_wave_rest_hot = obs_wave / (1 + redshift)
-    kappa_interp_hot = interpolate_kappa(wave_kappa_hot, kappa_hot, obs_wave_rest_hot)
-
-    # Interpolate kappa for the warm component (3 component model)
-    wave_kappa_warm, kappa_warm = import_coefficients(grain_size=grain_size, composition=composition_warm,
-                                                      interp_grain=False)
-    obs_wave_rest_warm = obs_wave / (1 + redshift)
-    kappa_interp_warm = interpolate_kappa(wave_kappa_warm, kappa_warm, obs_wave_rest_warm)
+    # Import and interpolate kappa for the cold (1 component model), hot (2 component model),
+    # and warm (3 component model) components, only once for each distinct composition
+    kappa_data = {}
+    kappa_interps = {}
+    obs_wave_rest = obs_wave / (1 + redshift)
+    for comp in (composition_cold, composition_hot, composition_warm):
+        if comp not in kappa_data:
+            kappa_data[comp] = import_coefficients(grain_size=grain_size, composition=comp, interp_grain=False)
+            kappa_interps[comp] = interpolate_kappa(*kappa_data[comp], obs_wave_rest)
+    kappa_interp_cold = kappa_interps[composition_cold]
+    kappa_interp_hot = kappa_interps[composition_hot]
+    kappa_interp_warm = kappa_interps[composition_warm]
+
+    # Pre-calculate the filter integration weights and observed data shared by all models
+    if obs_wave_filters is not None:
+        filter_weights = calc_filter_weights(obs_wave.to(u.micron).value, obs_wave_filters, obs_trans_filters)
+    else:
+        filter_weights = None
+    fit_data = prepare_fit_data(obs_flux, obs_flux_err, obs_limits)
 
     # Get the best parameters for the first model
     best_params_1 = [results_1[key][0] for key in results_1.keys()][:-1]
@@ -1723,29 +2048,40 @@ def compare_models(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
                                 kappa_interp_cold, redshift, distance, radius, n_components=1,
                                 obs_wave_filters=obs_wave_filters, obs_trans_filters=obs_trans_filters,
                                 kappa_interp_hot=None, kappa_interp_cold=None, kappa_interp_warm=None,
-                                dust_type=dust_type, add_sigma=add_sigma)
-
-    # Get the best parameters for the second model
-    best_params_2 = [results_2[key][0] for key in results_2.keys()][:-1]
-    log_like_2 = log_likelihood(best_params_2, obs_wave, obs_flux, obs_flux_err, obs_limits,
-                                kappa_interp_hot, redshift, distance, radius, n_components=2,
-                                obs_wave_filters=obs_wave_filters, obs_trans_filters=obs_trans_filters,
-                                kappa_interp_hot=kappa_interp_hot, kappa_interp_cold=kappa_interp_cold,
-                                kappa_interp_warm=kappa_interp_warm, dust_type=dust_type, add_sigma=add_sigma)
+                                dust_type=dust_type, add_sigma=add_sigma,
+                                filter_weights=filter_weights, fit_data=fit_data)
+
+    # Get the best parameters for the second model, models that were not fit have a nan likelihood
+    if results_2 is not None:
+        best_params_2 = [results_2[key][0] for key in results_2.keys()][:-1]
+        log_like_2 = log_likelihood(best_params_2, obs_wave, obs_flux, obs_flux_err, obs_limits,
+                                    kappa_interp_hot, redshift, distance, radius, n_components=2,
+                                    obs_wave_filters=obs_wave_filters, obs_trans_filters=obs_trans_filters,
+                                    kappa_interp_hot=kappa_interp_hot, kappa_interp_cold=kappa_interp_cold,
+                                    kappa_interp_warm=kappa_interp_warm, dust_type=dust_type, add_sigma=add_sigma,
+                                    filter_weights=filter_weights, fit_data=fit_data)
+        n_params_2 = len(best_params_2)  # two components with log_mass and temperature
+    else:
+        log_like_2 = np.nan
+        n_params_2 = np.nan
 
     # Get the best parameters for the third model
-    best_params_3 = [results_3[key][0] for key in results_3.keys()][:-1]
-    log_like_3 = log_likelihood(best_params_3, obs_wave, obs_flux, obs_flux_err, obs_limits,
-                                kappa_interp_hot, redshift, distance, radius, n_components=3,
-                                obs_wave_filters=obs_wave_filters, obs_trans_filters=obs_trans_filters,
-                                kappa_interp_hot=kappa_interp_hot, kappa_interp_cold=kappa_interp_cold,
-                                kappa_interp_warm=kappa_interp_warm, dust_type=dust_type, add_sigma=add_sigma)
+    if results_3 is not None:
+        best_params_3 = [results_3[key][0] for key in results_3.keys()][:-1]
+        log_like_3 = log_likelihood(best_params_3, obs_wave, obs_flux, obs_flux_err, obs_limits,
+                                    kappa_interp_hot, redshift, distance, radius, n_components=3,
+                                    obs_wave_filters=obs_wave_filters, obs_trans_filters=obs_trans_filters,
+                                    kappa_interp_hot=kappa_interp_hot, kappa_interp_cold=kappa_interp_cold,
+                                    kappa_interp_warm=kappa_interp_warm, dust_type=dust_type, add_sigma=add_sigma,
+                                    filter_weights=filter_weights, fit_data=fit_data)
+        n_params_3 = len(best_params_3)  # three components with log_mass and temperature
+    else:
+        log_like_3 = np.nan
+        n_params_3 = np.nan
 
     # Calculate AIC and BIC
     n_data = len(obs_flux)
     n_params_1 = len(best_params_1)  # one component with log_mass and temperature
-    n_params_2 = len(best_params_2)  # two components with log_mass and temperature
-    n_params_3 = len(best_params_3)  # three components with log_mass and temperature
 
     aic_1comp = 2 * n_params_1 - 2 * log_like_1
     aic_2comp = 2 * n_params_2 - 2 * log_like_2
@@ -1764,14 +2100,15 @@ def compare_models(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
                      fmt='o', color='black', label='Observed data', zorder=3)
 
         # Fine grid for smooth model curves
-        wave_dense = np.logspace(np.log10(obs_wave.value.min()*0.5),
-                                 np.log10(obs_wave.value.max()*1.5), 200) * u.micron
+        wave_dense = np.geomspace(obs_wave.value.min()*0.5, obs_wave.value.max()*1.5, 200) * u.micron
 
         # Interpolate kappa to the fine grid's rest wavelengths
         wave_dense_rest = wave_dense / (1 + redshift)
-        kappa_dense_cold = interpolate_kappa(wave_kappa_cold, kappa_cold, wave_dense_rest)
-        kappa_dense_hot = interpolate_kappa(wave_kappa_hot, kappa_hot, wave_dense_rest)
-        kappa_dense_warm = interpolate_kappa(wave_kappa_warm, kappa_warm, wave_dense_rest)
+        kappa_dense = {comp: interpolate_kappa(wave_kappa_comp, kappa_comp, wave_dense_rest)
+                       for comp, (wave_kappa_comp, kappa_comp) in kappa_data.items()}
+        kappa_dense_cold = kappa_dense[composition_cold]
+        kappa_dense_hot = kappa_dense[composition_hot]
+        kappa_dense_warm = kappa_dense[composition_warm]
 
         # Plot 1-component model
         if add_sigma:
@@ -1784,67 +2121,71 @@ def compare_models(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
                  label=f'1-component (BIC = {bic_1comp:.2f} - AIC = {aic_1comp:.2f})', alpha=0.7)
 
         # Plot 2-component model
-        if add_sigma:
-            best_params_2_use = best_params_2[:-1]
-        else:
-            best_params_2_use = best_params_2
-        model_2comp = model_flux(best_params_2_use, wave_dense, obs_flux, kappa_dense_hot,
-                                 redshift, distance, radius, n_components=2,
-                                 kappa_interp_hot=kappa_dense_hot, kappa_interp_cold=kappa_dense_cold,
-                                 dust_type=dust_type)
-        plt.plot(wave_dense.value, model_2comp.value, 'r-', linewidth=2,
-                 label=f'2-component (BIC = {bic_2comp:.2f} - AIC = {aic_2comp:.2f})', alpha=0.7)
+        if results_2 is not None:
+            if add_sigma:
+                best_params_2_use = best_params_2[:-1]
+            else:
+                best_params_2_use = best_params_2
+            model_2comp = model_flux(best_params_2_use, wave_dense, obs_flux, kappa_dense_hot,
+                                     redshift, distance, radius, n_components=2,
+                                     kappa_interp_hot=kappa_dense_hot, kappa_interp_cold=kappa_dense_cold,
+                                     dust_type=dust_type)
+            plt.plot(wave_dense.value, model_2comp.value, 'r-', linewidth=2,
+                     label=f'2-component (BIC = {bic_2comp:.2f} - AIC = {aic_2comp:.2f})', alpha=0.7)
 
         # Plot 3-component model
-        if add_sigma:
-            best_params_3_use = best_params_3[:-1]
-        else:
-            best_params_3_use = best_params_3
-        model_3comp = model_flux(best_params_3_use, wave_dense, obs_flux, kappa_dense_hot,
-                                 redshift, distance, radius, n_components=3,
-                                 kappa_interp_hot=kappa_dense_hot, kappa_interp_cold=kappa_dense_cold,
-                                 kappa_interp_warm=kappa_dense_warm, dust_type=dust_type)
-        plt.plot(wave_dense.value, model_3comp.value, 'g-', linewidth=2,
-                 label=f'3-component (BIC = {bic_3comp:.2f} - AIC = {aic_3comp:.2f})', alpha=0.7)
+        if results_3 is not None:
+            if add_sigma:
+                best_params_3_use = best_params_3[:-1]
+            else:
+                best_params_3_use = best_params_3
+            model_3comp = model_flux(best_params_3_use, wave_dense, obs_flux, kappa_dense_hot,
+                                     redshift, distance, radius, n_components=3,
+                                     kappa_interp_hot=kappa_dense_hot, kappa_interp_cold=kappa_dense_cold,
+                                     kappa_interp_warm=kappa_dense_warm, dust_type=dust_type)
+            plt.plot(wave_dense.value, model_3comp.value, 'g-', linewidth=2,
+                     label=f'3-component (BIC = {bic_3comp:.2f} - AIC = {aic_3comp:.2f})', alpha=0.7)
 
         # Plot individual components of the 2-component model
-        # Cold component
-        comp1_params = (best_params_2[0], best_params_2[1])
-        comp1_model = model_flux(comp1_params, wave_dense, obs_flux, kappa_dense_cold,
-                                 redshift, distance, radius, n_components=1, dust_type=dust_type)
-        plt.plot(wave_dense.value, comp1_model.value, 'r--', alpha=0.5, linewidth=1.5,
-                 label='Cold (2-comp)')
-
-        # Hot component
-        comp2_params = (best_params_2[2], best_params_2[3])
-        comp2_model = model_flux(comp2_params, wave_dense, obs_flux, kappa_dense_hot,
-                                 redshift, distance, radius, n_components=1, dust_type=dust_type)
-        plt.plot(wave_dense.value, comp2_model.value, 'r:', alpha=0.5, linewidth=1.5,
-                 label='Hot (2-comp)')
+        if results_2 is not None:
+            # Cold component
+            comp1_params = (best_params_2[0], best_params_2[1])
+            comp1_model = model_flux(comp1_params, wave_dense, obs_flux, kappa_dense_cold,
+                                     redshift, distance, radius, n_components=1, dust_type=dust_type)
+            plt.plot(wave_dense.value, comp1_model.value, 'r--', alpha=0.5, linewidth=1.5,
+                     label='Cold (2-comp)')
+
+            # Hot component
+            comp2_params = (best_params_2[2], best_params_2[3])
+            comp2_model = model_flux(comp2_params, wave_dense, obs_flux, kappa_dense_hot,
+                                     redshift, distance, radius, n_components=1, dust_type=dust_type)
+            plt.plot(wave_dense.value, comp2_model.value, 'r:', alpha=0.5, linewidth=1.5,
+                     label='Hot (2-comp)')
 
         # Plot individual components of the 3-component model
-        # Cold component
-        comp1_params_3 = (best_params_3[0], best_params_3[1])
-        comp1_model_3 = model_flux(comp1_params_3, wave_dense, obs_flux, kappa_dense_cold,
-                                   redshift, distance, radius, n_components=1, dust_type=dust_type)
-        plt.plot(wave_dense.value, comp1_model_3.value, 'g--', alpha=0.5, linewidth=1.5,
-                 label='Cold (3-comp)')
-        # Warm component
-        comp3_params = (best_params_3[4], best_params_3[5])
-        comp3_model = model_flux(comp3_params, wave_dense, obs_flux, kappa_dense_warm,
-                                 redshift, distance, radius, n_components=1, dust_type=dust_type)
-        plt.plot(wave_dense.value, comp3_model.value, 'g-.', alpha=0.5, linewidth=1.5,
-                 label='Warm (3-comp)')
-        # Hot component
-        comp2_params_3 = (best_params_3[2], best_params_3[3])
-        comp2_model_3 = model_flux(comp2_params_3, wave_dense, obs_flux, kappa_dense_hot,
-                                   redshift, distance, radius, n_components=1, dust_type=dust_type)
-        plt.plot(wave_dense.value, comp2_model_3.value, 'g:', alpha=0.5, linewidth=1.5,
-                 label='Hot (3-comp)')
+        if results_3 is not None:
+            # Cold component
+            comp1_params_3 = (best_params_3[0], best_params_3[1])
+            comp1_model_3 = model_flux(comp1_params_3, wave_dense, obs_flux, kappa_dense_cold,
+                                       redshift, distance, radius, n_components=1, dust_type=dust_type)
+            plt.plot(wave_dense.value, comp1_model_3.value, 'g--', alpha=0.5, linewidth=1.5,
+                     label='Cold (3-comp)')
+            # Warm component
+            comp3_params = (best_params_3[4], best_params_3[5])
+            comp3_model = model_flux(comp3_params, wave_dense, obs_flux, kappa_dense_warm,
+                                     redshift, distance, radius, n_components=1, dust_type=dust_type)
+            plt.plot(wave_dense.value, comp3_model.value, 'g-.', alpha=0.5, linewidth=1.5,
+                     label='Warm (3-comp)')
+            # Hot component
+            comp2_params_3 = (best_params_3[2], best_params_3[3])
+            comp2_model_3 = model_flux(comp2_params_3, wave_dense, obs_flux, kappa_dense_hot,
+                                       redshift, distance, radius, n_components=1, dust_type=dust_type)
+            plt.plot(wave_dense.value, comp2_model_3.value, 'g:', alpha=0.5, linewidth=1.5,
+                     label='Hot (3-comp)')
 
         # Determine the optimal y-axis limits
-        ymin = 10 ** (np.log10(np.nanmin(obs_flux.value)) - 0.2)
-        ymax = 10 ** (np.log10(np.nanmax(obs_flux.value)) + 0.2)
+        ymin = np.nanmin(obs_flux.value) * 10 ** -0.2
+        ymax = np.nanmax(obs_flux.value) * 10 ** 0.2
 
         # Determine the optimal x-axis limits
         xmin = np.min([5, np.min(obs_wave.value) * 0.9])
@@ -1880,11 +2221,42 @@ def compare_models(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, objec
     }
 
 
+def _fit_components(n_data, add_sigma=True, force_all=True):
+    """
+    Choose which models to fit, skipping the ones with as many free parameters
+    as data points or more, unless all of them are forced.
+
+    Parameters
+    ----------
+    n_data : int
+        Number of data points
+    add_sigma : bool, default True
+        Whether the models include the sigma parameter
+    force_all : bool, default True
+        Fit all models regardless of the number of data points
+
+    Returns
+    -------
+    components : list
+        Number of components of the models to fit, the 1-component model is always fit
+    """
+
+    components = []
+    for n_components in [3, 2]:
+        if force_all or (2 * n_components + add_sigma < n_data):
+            components.append(n_components)
+        else:
+            print(f"Skipping the {n_components}-component model, which has as many free parameters as the {n_data} data points or more.")
+    components.append(1)
+
+    return components
+
+
 def full_model(filename, object_name, redshift, composition='carbon', grain_size=0.1, n_walkers=50, n_steps=1000, burn_in=0.75,
                n_cores=1, sigma_clip=2, repeats=3, emcee_progress=True, n_filter_samples=1000, plot=True, plots_model=False,
                plots_corner=False, plots_trace=False, output_dir='.', initial_pos=None, priors=None, composition_hot=None,
                composition_cold=None, composition_warm=None, dust_type='thin', radius=None, flat_mass_prior=True, add_sigma=True,
-               distance=None):
+               distance=None, force_all=True, parallel_models=False):
     """
     Run the full model fitting process.
 
@@ -1907,7 +2279,8 @@ def full_model(filename, object_name, redshift, composition='carbon', grain_size
     burn_in : float, default 0.75
         Fraction of steps to discard as burn-in
     n_cores : int, default 1
-        Number of CPU cores to use for parallel processing
+        Number of CPU cores to use for parallel processing. Without numba, the
+        calling script must protect its entry point with if __name__ == "__main__":
     sigma_clip : float, default 2
         Sigma clipping threshold for outlier rejection
     repeats : int, default 3
@@ -1946,6 +2319,14 @@ def full_model(filename, object_name, redshift, composition='carbon', grain_size
         If True, add an additional variance to the uncertainties defined by the sigma parameter.
     distance : Quantity, optional
         Luminosity distance in astropy units. If None, it will be calculated from the redshift.
+    force_all : bool, default True
+        If True, fit all three models. If False, skip the 2 and 3-component
+        models when they have at least as many free parameters as data points,
+        since the data can not constrain them.
+    parallel_models : bool, default False
+        If True and n_cores is 1, run the fits of the different models at the same
+        time in separate processes. The calling script must protect its entry
+        point with if __name__ == "__main__":
 
     Returns
     -------
@@ -1964,31 +2345,37 @@ def full_model(filename, object_name, redshift, composition='carbon', grain_size
     if composition_warm is None:
         composition_warm = composition
 
-    # Fit all models
-    results_3, last_samples_3 = fit_dust_model(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, object_name, composition=composition,
-                                               grain_size=grain_size, n_components=3, n_walkers=n_walkers, n_steps=n_steps, burn_in=burn_in,
-                                               n_cores=n_cores, sigma_clip=sigma_clip, repeats=repeats, emcee_progress=emcee_progress,
-                                               obs_wave_filters=obs_wave_filters, obs_trans_filters=obs_trans_filters, n_filter_samples=n_filter_samples,
-                                               plot=plot, plots_model=plots_model, plots_corner=plots_corner, plots_trace=plots_trace, output_dir=output_dir,
-                                               initial_pos=initial_pos, priors=priors, composition_hot=composition_hot, composition_cold=composition_cold,
-                                               composition_warm=composition_warm, dust_type=dust_type, radius=radius, flat_mass_prior=flat_mass_prior,
-                                               add_sigma=add_sigma, distance=distance)
-
-    results_2, last_samples_2 = fit_dust_model(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, object_name, composition=composition,
-                                               grain_size=grain_size, n_components=2, n_walkers=n_walkers, n_steps=n_steps, burn_in=burn_in,
-                                               n_cores=n_cores, sigma_clip=sigma_clip, repeats=repeats, emcee_progress=emcee_progress,
-                                               obs_wave_filters=obs_wave_filters, obs_trans_filters=obs_trans_filters, n_filter_samples=n_filter_samples,
-                                               plot=plot, plots_model=plots_model, plots_corner=plots_corner, plots_trace=plots_trace, output_dir=output_dir,
-                                               initial_pos=initial_pos, priors=priors, composition_hot=composition_hot, composition_cold=composition_cold,
-                                               dust_type=dust_type, radius=radius, flat_mass_prior=flat_mass_prior, add_sigma=add_sigma, distance=distance)
-
-    results_1, last_samples_1 = fit_dust_model(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, object_name, composition=composition_cold,
-                                               grain_size=grain_size, n_components=1, n_walkers=n_walkers, n_steps=n_steps, burn_in=burn_in,
-                                               n_cores=n_cores, sigma_clip=sigma_clip, repeats=repeats, emcee_progress=emcee_progress,
-                                               obs_wave_filters=obs_wave_filters, obs_trans_filters=obs_trans_filters, n_filter_samples=n_filter_samples,
-                                               plot=plot, plots_model=plots_model, plots_corner=plots_corner, plots_trace=plots_trace, output_dir=output_dir,
-                                               initial_pos=initial_pos, priors=priors, dust_type=dust_type, radius=radius, flat_mass_prior=flat_mass_prior,
-                                               add_sigma=add_sigma, distance=distance)
+    # Only fit models with fewer free parameters than data points, unless forced
+    components = _fit_components(len(obs_flux), add_sigma=add_sigma, force_all=force_all)
+
+    # Arguments shared by the fits of all models
+    fit_args = (obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, object_name)
+    fit_kwargs = dict(grain_size=grain_size, n_walkers=n_walkers, n_steps=n_steps, burn_in=burn_in, n_cores=n_cores,
+                      sigma_clip=sigma_clip, repeats=repeats, emcee_progress=emcee_progress, obs_wave_filters=obs_wave_filters,
+                      obs_trans_filters=obs_trans_filters, n_filter_samples=n_filter_samples, plot=plot, plots_model=plots_model,
+                      plots_corner=plots_corner, plots_trace=plots_trace, output_dir=output_dir, initial_pos=initial_pos,
+                      priors=priors, dust_type=dust_type, radius=radius, flat_mass_prior=flat_mass_prior, add_sigma=add_sigma,
+                      distance=distance)
+    compositions = {3: dict(composition=composition, composition_hot=composition_hot, composition_cold=composition_cold,
+                            composition_warm=composition_warm),
+                    2: dict(composition=composition, composition_hot=composition_hot, composition_cold=composition_cold),
+                    1: dict(composition=composition_cold)}
+
+    # Fit all models, the independent fits can run in separate processes when
+    # each of them only uses one core and there are spare cores
+    max_workers = min(len(components), os.cpu_count() or 1)
+    if parallel_models and (n_cores == 1) and (max_workers > 1):
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=_process_context()) as executor:
+            futures = {n_components: executor.submit(fit_dust_model, *fit_args, n_components=n_components,
+                                                     **fit_kwargs, **compositions[n_components])
+                       for n_components in components}
+            fits = {n_components: future.result() for n_components, future in futures.items()}
+    else:
+        fits = {n_components: fit_dust_model(*fit_args, n_components=n_components, **fit_kwargs, **compositions[n_components])
+                for n_components in components}
+    results_3 = fits[3][0] if 3 in fits else None
+    results_2 = fits[2][0] if 2 in fits else None
+    results_1 = fits[1][0]
 
     results = compare_models(obs_wave, obs_flux, obs_flux_err, obs_limits, redshift, object_name, results_1,
                              results_2, results_3, grain_size=grain_size, obs_wave_filters=obs_wave_filters,
@@ -1,6 +1,7 @@
 import os
 import corner
 from matplotlib import gridspec
+from matplotlib.collections import LineCollection
 from .utils import compute_rhat
 import numpy as np
 import matplotlib.pyplot as plt
@@ -133,7 +134,9 @@ def plot_trace(param_chain, param_values, param_values_log, min_val, max_val,
     ax0.axhline(param_values[0] - param_values[2], color='r', lw=1.0, linestyle='--', alpha=0.50)
     ax0.axhline(param_values[0] + param_values[1], color='r', lw=1.0, linestyle='--', alpha=0.50)
     ax0.plot(Averageline, lw=1.0, color='b', alpha=0.75)
-    ax0.plot(param_chain.T, '-', color='k', alpha=0.2, lw=0.5)
+    # Draw all walkers as a single collection instead of one line each
+    steps = np.broadcast_to(np.arange(param_chain.shape[1]), param_chain.shape)
+    ax0.add_collection(LineCollection(np.stack([steps, param_chain], axis=-1), color='k', alpha=0.2, lw=0.5))
 
     # Add Gelman-Rubin statistic for multiple chains
     if param_chain.shape[0] > 1:
@@ -0,0 +1,42 @@
+import pytest
+import numpy as np
+import scipy.special as sp
+from dustysn.kernels import planck_kernel, log_ndtr_kernel, model_flux_kernel, ln_like_kernel, k_B_cgs, c_cgs
+from dustysn.model import log_probability_batch, prepare_fit_data, ref_priors
+
+
+def test_planck_kernel():
+    # Deep in the Rayleigh-Jeans tail the Planck function should match
+    # 2 nu^2 k T / c^2 without losing precision
+    nu_hz = np.array([1e3, 1e5, 1e7])
+    temperature = 1e4
+    output = planck_kernel(nu_hz, temperature)
+    expected = 2 * nu_hz**2 * k_B_cgs * temperature / c_cgs**2
+    assert np.allclose(output, expected, rtol=1e-10)
+    # And the Wien tail should underflow to zero instead of nan
+    assert planck_kernel(np.array([1e18]), 10.0)[0] == 0.0
+
+
+def test_log_ndtr_kernel():
+    # Should match scipy in the core and both tails of the distribution
+    z = np.array([-1e3, -37.5, -20.0, -19.9, -3.0, 0.0, 2.0, 30.0])
+    output = np.array([log_ndtr_kernel(i) for i in z])
+    assert np.allclose(output, sp.log_ndtr(z), rtol=1e-10, atol=0)
+
+
+@pytest.mark.skipif(not hasattr(model_flux_kernel, 'signatures'), reason='requires numba')
+def test_kernel_signatures():
+    # The sampler should reuse the signatures compiled at import, with and without filters
+    obs_wave = np.linspace(5, 25, 40)
+    obs_flux = np.full(4, 1e-3)
+    obs_flux_err = np.full(4, 1e-4)
+    obs_limits = np.array([False, False, False, True])
+    filter_weights = np.kron(np.eye(4), np.full(10, 0.1))
+    fit_data = prepare_fit_data(obs_flux, obs_flux_err, obs_limits)
+    thetas = np.array([[-3.0, 300.0, -5.0, 1000.0, 0.0], [-3.5, 250.0, -6.0, 900.0, -1.0]])
+    for weights, n_wave in [(filter_weights, 40), (None, 4)]:
+        log_probability_batch(thetas, obs_wave[:n_wave], obs_flux, obs_flux_err, obs_limits, np.ones(n_wave), 0.01, 1e26,
+                              n_components=2, kappa_interp_hot=np.ones(n_wave), kappa_interp_cold=np.ones(n_wave),
+                              priors=ref_priors, filter_weights=weights, fit_data=fit_data)
+        assert len(model_flux_kernel.signatures) == 1
+        assert len(ln_like_kernel.signatures) == 1
@@ -0,0 +1,149 @@
+import pytest
+import emcee
+import numpy as np
+import astropy.units as u
+from astropy.modeling.models import BlackBody
+import dustysn.model
+from dustysn.model import (calc_luminosity, calc_model_flux, model_flux, log_likelihood, log_prior, log_prior_batch,
+                           log_probability, log_probability_batch, ref_priors, fit_dust_model, compare_models,
+                           _fit_components)
+
+
+def test_calc_luminosity():
+    # Compare the unitless path to the Astropy blackbody
+    rest_wave = np.linspace(3, 30, 50) * u.micron
+    kappa = np.full(50, 1000.0) * u.cm**2 / u.g
+    output = calc_luminosity(rest_wave, kappa, 1e-3, 500)
+    bb = BlackBody(temperature=500 * u.K)
+    expected = (1e-3 * u.Msun * kappa * bb(rest_wave) * (4 * np.pi * u.sr)).to(u.erg / u.s / u.Hz)
+    assert output.unit == u.erg / u.s / u.Hz
+    assert np.allclose(output.value, expected.value, rtol=1e-8)
+
+
+def test_model_flux():
+    # The fused kernel should match the sum of the individual components
+    obs_wave = np.linspace(5, 25, 30) * u.micron
+    kappa = np.full(30, 1000.0) * u.cm**2 / u.g
+    theta = (-3.0, 400.0, -5.0, 1200.0)
+    output = model_flux(theta, obs_wave, None, kappa, 0.01, 1e26, n_components=2)
+    cold = calc_model_flux(obs_wave, 10**theta[0], theta[1], 0.01, distance=1e26, kappa_interp=kappa)
+    hot = calc_model_flux(obs_wave, 10**theta[2], theta[3], 0.01, distance=1e26, kappa_interp=kappa)
+    assert np.allclose(output.value, (cold + hot).value, rtol=1e-8)
+
+
+def test_log_likelihood_limits():
+    # Upper limits far from the model should stay finite
+    obs_wave = np.array([10.0, 20.0]) * u.micron
+    obs_flux = np.array([1e-3, 1e-3]) * u.Jy
+    obs_flux_err = np.array([1e-4, 1e-4]) * u.Jy
+    obs_limits = np.array([False, True])
+    kappa = np.full(2, 1000.0) * u.cm**2 / u.g
+    output = log_likelihood((-8.0, 100.0), obs_wave, obs_flux, obs_flux_err, obs_limits, kappa,
+                            0.01, 1e26, add_sigma=False)
+    assert np.isfinite(output)
+
+
+def test_log_prior_batch():
+    # The array mask should match the scalar prior for every walker
+    rng = np.random.default_rng(0)
+    for n_components in [1, 2, 3]:
+        thetas = np.column_stack([rng.uniform(-9, 2, 200), rng.uniform(0, 3200, 200)] * n_components +
+                                 [rng.uniform(-4, 4, 200)])
+        for flat_mass_prior in [True, False]:
+            expected = [log_prior(theta, ref_priors, n_components, flat_mass_prior) for theta in thetas]
+            output = log_prior_batch(thetas, ref_priors, n_components, flat_mass_prior)
+            assert np.allclose(output, expected, rtol=1e-12)
+
+
+def test_log_probability_batch():
+    # Walkers outside the prior should be rejected before computing a model,
+    # and the rest should match the single walker log-probability
+    obs_wave = np.linspace(5, 25, 6)
+    obs_flux = np.full(6, 1e-3)
+    obs_flux_err = np.full(6, 1e-4)
+    obs_limits = np.array([False, False, False, False, False, True])
+    kappa = np.full(6, 1000.0)
+    thetas = np.array([[-3.0, 400.0, 0.0], [-3.0, -10.0, 0.0], [-3.0, 300.0, -1.0], [5.0, 400.0, 0.0]])
+    args = (obs_wave, obs_flux, obs_flux_err, obs_limits, kappa, 0.01, 1e26)
+    output = log_probability_batch(thetas, *args, priors=ref_priors)
+    expected = [log_probability(theta, *args, priors=ref_priors) for theta in thetas]
+    assert np.array_equal(np.isinf(output), [False, True, False, True])
+    assert np.allclose(output, expected, rtol=1e-10)
+
+
+def fake_data():
+    # Photometry of a single warm dust component with one upper limit
+    obs_wave = np.array([5.6, 7.7, 10.0, 11.3, 15.0, 18.0, 21.0, 25.5]) * u.micron
+    obs_flux = np.array([1.2e-4, 2.5e-4, 4.0e-4, 4.5e-4, 5.0e-4, 4.0e-4, 3.0e-4, 2.0e-4]) * u.Jy
+    obs_flux_err = 0.1 * obs_flux
+    obs_limits = np.array([False, False, False, False, False, False, False, True])
+    return obs_wave, obs_flux, obs_flux_err, obs_limits
+
+
+def test_initial_pos_outside_prior(tmp_path):
+    # Walkers can not be drawn when the cold dust is forced hotter than the hot dust
+    initial_pos = dict(ref_priors, temp_cold=(2000, 2100), temp_hot=(100, 200))
+    with pytest.raises(ValueError, match='initial_pos'):
+        fit_dust_model(*fake_data(), 0.001, 'test', n_components=2, n_walkers=8, n_steps=10, repeats=1,
+                       emcee_progress=False, output_dir=str(tmp_path), initial_pos=initial_pos)
+
+
+def test_compare_models_skipped(tmp_path):
+    # The comparison works when only the 1-component model was fit
+    results_1 = {'log_dust_mass_cold': [-3.0], 'temp_cold': [400.0], 'total_dust_mass': [1e-3], 'sigma': [-0.5]}
+    results = compare_models(*fake_data(), 0.001, 'test', results_1, results_2=None, results_3=None, plot_comparison=False,
+                             output_dir=str(tmp_path), composition_cold='carbon', composition_hot='carbon',
+                             composition_warm='carbon', add_sigma=True)
+    comparison = results['comparison']
+    assert np.isfinite([comparison['log_like_1'], comparison['aic_1comp'], comparison['bic_1comp']]).all()
+    assert np.isnan([comparison['aic_2comp'], comparison['bic_2comp'], comparison['aic_3comp'], comparison['bic_3comp']]).all()
+
+
+def test_fit_components():
+    # With 5 data points and sigma, the 2- and 3-component models have too many parameters
+    assert _fit_components(5, add_sigma=True, force_all=False) == [1]
+    assert _fit_components(6, add_sigma=True, force_all=False) == [2, 1]
+    assert _fit_components(8, add_sigma=True, force_all=False) == [3, 2, 1]
+    assert _fit_components(5, add_sigma=True, force_all=True) == [3, 2, 1]
+
+
+def test_fit_dust_model_thin_by(tmp_path, monkeypatch):
+    # Keep the sampler of the last run to compare it with the results
+    samplers = []
+    mcmc_with_sigma_clipping = dustysn.model.mcmc_with_sigma_clipping
+
+    def keep_sampler(*args, **kwargs):
+        samplers.append(mcmc_with_sigma_clipping(*args, **kwargs))
+        return samplers[-1]
+
+    monkeypatch.setattr(dustysn.model, 'mcmc_with_sigma_clipping', keep_sampler)
+
+    n_walkers, n_steps, thin_by, repeats = 8, 20, 5, 2
+    results, _ = fit_dust_model(*fake_data(), 0.001, 'test', n_walkers=n_walkers, n_steps=n_steps, repeats=repeats,
+                                emcee_progress=False, output_dir=str(tmp_path), thin_by=thin_by)
+    sampler = samplers[-1]
+    assert sampler.iteration == repeats * n_steps // thin_by
+
+    # Only the steps saved in the last run are used
+    samples_crop = sampler.get_chain(discard=sampler.iteration - n_steps // thin_by, flat=True)
+    assert len(samples_crop) == n_walkers * n_steps // thin_by
+    assert np.isclose(results['temp_cold'][0], np.median(samples_crop[:, 1]))
+
+
+def test_fit_dust_model_backend(tmp_path):
+    n_walkers, n_steps, repeats = 8, 10, 2
+    backend_path = str(tmp_path / 'chain.h5')
+    results, _ = fit_dust_model(*fake_data(), 0.001, 'test', n_walkers=n_walkers, n_steps=n_steps, repeats=repeats,
+                                emcee_progress=False, output_dir=str(tmp_path), backend_path=backend_path)
+
+    # The chain of all runs is written to disk
+    chain = emcee.backends.HDFBackend(backend_path, read_only=True).get_chain()
+    assert chain.shape == (repeats * n_steps, n_walkers, 3)
+    assert np.all(np.isfinite(chain))
+    assert np.isclose(results['temp_cold'][0], np.median(chain[-n_steps:, :, 1]))
+
+
+def test_fit_dust_model_thin_by_steps(tmp_path):
+    with pytest.raises(ValueError, match='thin_by'):
+        fit_dust_model(*fake_data(), 0.001, 'test', n_walkers=8, n_steps=12, thin_by=5, emcee_progress=False,
+                       output_dir=str(tmp_path))
@@ -1,7 +1,10 @@
 # import os
 # import pytest
-# import numpy as np
-from dustysn.utils import (calc_distance)
+import numpy as np
+import astropy.units as u
+from scipy import interpolate
+from dustysn.utils import (calc_distance, calc_filter_flux, calc_filter_weights, import_coefficients,
+                           interpolate_kappa, read_kappa_file)
 
 
 def test_calc_distance():
@@ -9,3 +12,35 @@ def test_calc_distance():
     output = calc_distance(0.1).value
     # Check that the output is a float
     assert isinstance(output, float)
+
+
+def test_calc_filter_weights():
+    # The weights should reproduce calc_filter_flux, even for unsorted
+    # wavelengths and filters that are only partly covered by the model
+    obs_wave = np.random.default_rng(1).permutation(np.linspace(5, 20, 40))
+    flux = obs_wave ** 2
+    filt_waves = [np.linspace(6, 8, 30), np.linspace(18, 25, 30), np.linspace(30, 35, 30)]
+    filt_trans = [np.hanning(30), np.ones(30), np.ones(30)]
+    weights = calc_filter_weights(obs_wave, filt_waves, filt_trans)
+    expected = [calc_filter_flux(obs_wave, flux, w, t) for w, t in zip(filt_waves, filt_trans)]
+    assert np.allclose(weights.dot(flux), expected, rtol=1e-10)
+
+
+def test_interpolate_kappa():
+    # Should match a linear interp1d, including the extrapolation below the silicate data
+    wave_kappa, kappa = import_coefficients(grain_size=0.1, composition='silicate')
+    wave_rest = np.linspace(2, 200, 300) * u.micron
+    output = interpolate_kappa(wave_kappa, kappa, wave_rest)
+    expected = interpolate.interp1d(wave_kappa.value, kappa.value, fill_value='extrapolate')(wave_rest.value)
+    assert output.unit == u.cm**2 / u.g
+    assert np.allclose(output.value, expected, rtol=1e-10)
+
+
+def test_import_coefficients():
+    # Repeated imports should come from the cache but return independent arrays
+    wave_kappa, kappa = import_coefficients(grain_size=0.1, composition='carbon')
+    kappa[0] = 0 * u.cm**2 / u.g
+    wave_kappa_2, kappa_2 = import_coefficients(grain_size=0.1, composition='carbon')
+    assert kappa_2[0].value > 0
+    assert np.array_equal(wave_kappa.value, wave_kappa_2.value)
+    assert read_kappa_file.cache_info().hits > 0
@@ -1,8 +1,10 @@
 from scipy import interpolate
+from scipy import sparse
 import numpy as np
 from astropy import table
 from astropy.cosmology import Planck18 as cosmo
 from astropy import units as u
+import functools
 import os
 
 
@@ -57,6 +59,35 @@ def import_cenwave_table(data_dir=data_dir):
     return cenwave_table
 
 
+@functools.lru_cache(maxsize=32)
+def read_kappa_file(file_path):
+    """
+    Read a file of mass absorption coefficients. The result is cached,
+    so each file is only parsed once per session.
+
+    Parameters
+    ----------
+    file_path : str
+        Path to the file of mass absorption coefficients
+
+    Returns
+    -------
+    columns : dict
+        Read-only numpy array of each column in the file
+    """
+
+    kappa_data = table.Table.read(file_path, format='ascii')
+
+    # Make the arrays read-only so the cached values can not be modified
+    columns = {}
+    for name in kappa_data.colnames:
+        column = np.array(kappa_data[name], dtype=float)
+        column.flags.writeable = False
+        columns[name] = column
+
+    return columns
+
+
 def import_coefficients(grain_size=0.1, composition='carbon', interp_grain=False,
                         data_dir=data_dir):
     """
@@ -92,7 +123,7 @@ def import_coefficients(grain_size=0.1, composition='carbon', interp_grain=False
         file_path = os.path.join(data_dir, 'dust', 'k_Silicate.dat')
     else:
         raise ValueError(f"Invalid composition {composition}. Choose 'carbon' or 'silicate'.")
-    kappa_data = table.Table.read(file_path, format='ascii')
+    kappa_data = read_kappa_file(file_path)
 
     # Extract the relevant data
     if not interp_grain:
@@ -139,14 +170,22 @@ def interpolate_kappa(wave_kappa, kappa, wave_rest):
         Interpolated dust opacity data in cm^2/g
     """
 
-    # Create interpolation function
-    f_kappa = interpolate.interp1d(wave_kappa.value, kappa.value,
-                                   bounds_error=False, fill_value="extrapolate")
+    # Sort the reference data for np.interp
+    order = np.argsort(wave_kappa.value)
+    wave_ref = np.asarray(wave_kappa.value, dtype=float)[order]
+    kappa_ref = np.asarray(kappa.value, dtype=float)[order]
+    wave_new = np.asarray(wave_rest.value, dtype=float)
+
+    # Interpolate linearly to rest wavelengths
+    kappa_interp = np.interp(wave_new, wave_ref, kappa_ref)
 
-    # Interpolate to rest wavelengths
-    kappa_interp = f_kappa(wave_rest.value) * u.cm**2 / u.g
+    # Extrapolate linearly from the first and last two points outside the reference range
+    slope_lo = (kappa_ref[1] - kappa_ref[0]) / (wave_ref[1] - wave_ref[0])
+    slope_hi = (kappa_ref[-1] - kappa_ref[-2]) / (wave_ref[-1] - wave_ref[-2])
+    kappa_interp = np.where(wave_new < wave_ref[0], kappa_ref[0] + (wave_new - wave_ref[0]) * slope_lo, kappa_interp)
+    kappa_interp = np.where(wave_new > wave_ref[-1], kappa_ref[-1] + (wave_new - wave_ref[-1]) * slope_hi, kappa_interp)
 
-    return kappa_interp
+    return kappa_interp * u.cm**2 / u.g
 
 
 def calc_filter_flux(obs_wave, flux_obs, filt_wave, filt_trans):
@@ -207,6 +246,80 @@ def calc_filter_flux(obs_wave, flux_obs, filt_wave, filt_trans):
     return numerator / denominator
 
 
+def calc_filter_weights(obs_wave, obs_wave_filters, obs_trans_filters):
+    """
+    Calculate a matrix of weights that integrates a model sampled at
+    obs_wave through a set of filters, such that the product of the matrix
+    and the model flux gives the same result as calc_filter_flux for each
+    filter. Since the filters are fixed during a fit, this can be computed
+    once and reused for every model evaluation.
+
+    Parameters
+    ----------
+    obs_wave : numpy.ndarray
+        Wavelength array of the model in microns
+    obs_wave_filters : list of arrays
+        Wavelengths of each filter in microns
+    obs_trans_filters : list of arrays
+        Transmission values (0-1) of each filter
+
+    Returns
+    -------
+    weights : scipy.sparse.csr_matrix
+        Matrix with shape (n_filters, len(obs_wave)) that converts the
+        model flux density into the integrated flux through each filter
+    """
+
+    # Sort the model wavelengths for the linear interpolation
+    obs_wave = np.asarray(obs_wave, dtype=float)
+    order = np.argsort(obs_wave)
+    sorted_wave = obs_wave[order]
+    min_wave = sorted_wave[0]
+    max_wave = sorted_wave[-1]
+
+    rows = []
+    cols = []
+    values = []
+    for i in range(len(obs_wave_filters)):
+        filt_wave = np.asarray(obs_wave_filters[i], dtype=float)
+        filt_trans = np.asarray(obs_trans_filters[i], dtype=float)
+
+        # Keep only filter wavelengths within the model wavelength range
+        mask = (filt_wave >= min_wave) & (filt_wave <= max_wave)
+        filtered_waves = filt_wave[mask]
+        filtered_trans = filt_trans[mask]
+        if len(filtered_waves) < 2:
+            continue
+
+        # Trapezoidal rule coefficients of the photon-weighted integrand
+        dwave = np.diff(filtered_waves)
+        trapz_coeffs = np.zeros(len(filtered_waves))
+        trapz_coeffs[:-1] += dwave / 2
+        trapz_coeffs[1:] += dwave / 2
+        integrand = trapz_coeffs * filtered_trans * filtered_waves
+        denominator = np.sum(integrand)
+        if denominator == 0:
+            continue
+
+        # Linear interpolation coefficients of the model at the filter wavelengths
+        upper = np.clip(np.searchsorted(sorted_wave, filtered_waves), 1, len(sorted_wave) - 1)
+        lower = upper - 1
+        slope = (filtered_waves - sorted_wave[lower]) / (sorted_wave[upper] - sorted_wave[lower])
+
+        rows.append(np.full(2 * len(filtered_waves), i))
+        cols.append(np.concatenate([order[lower], order[upper]]))
+        values.append(np.concatenate([integrand * (1 - slope), integrand * slope]) / denominator)
+
+    if len(rows) > 0:
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        values = np.concatenate(values)
+
+    # Repeated entries are summed when converting to CSR
+    weights = sparse.coo_matrix((values, (rows, cols)), shape=(len(obs_wave_filters), len(obs_wave)))
+    return weights.tocsr()
+
+
 def import_data(filename, data_dir=data_dir):
     """
     Import photometry data from the specified directory